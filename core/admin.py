@@ -2,11 +2,27 @@ from django.contrib import admin
 
 import core.models as models
 
+class QueuedSongAdmin(admin.ModelAdmin):
+    # the queue is mirrored in memory, changes have to go through its manager
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        models.QueuedSong.objects.reload_mirror()
+
+    def delete_model(self, request, obj):
+        try:
+            models.QueuedSong.objects.remove(obj.id)
+        except models.QueuedSong.DoesNotExist:
+            pass
+
+    def delete_queryset(self, request, queryset):
+        for song in queryset:
+            self.delete_model(request, song)
+
 # Register your models here.
 admin.site.register(models.Tag)
 admin.site.register(models.Counter)
 admin.site.register(models.Pad)
-admin.site.register(models.QueuedSong)
+admin.site.register(models.QueuedSong, QueuedSongAdmin)
 admin.site.register(models.CurrentSong)
 admin.site.register(models.ArchivedSong)
 admin.site.register(models.ArchivedPlaylist)
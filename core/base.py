@@ -1,6 +1,5 @@
 from django.conf import settings
 from django.http import HttpResponse
-from django.http import JsonResponse
 from django.http import HttpResponseBadRequest
 from django.http import HttpResponseRedirect
 from django.db import transaction
@@ -13,8 +12,10 @@ from core.pad import Pad
 from core.user_manager import UserManager
 import core.models as models
 import core.state_handler as state_handler
+import core.state_encoding as state_encoding
 
 import os
+import json
 import random
 import logging
 
@@ -27,6 +28,13 @@ class Base:
         self.pad = Pad(self)
         self.musiq = Musiq(self)
 
+        state_handler.register('base', self.state_dict)
+        state_handler.register('musiq', self.musiq.state_dict)
+        state_handler.register('lights', self.lights.state_dict)
+        state_handler.register('pad', self.pad.state_dict)
+        state_handler.register('settings', self.settings.state_dict)
+        state_handler.start_publisher()
+
     def get_random_hashtag(self):
         if models.Tag.objects.count() == 0:
             return 'no hashtags present :('
@@ -58,12 +66,14 @@ class Base:
             'pad_enabled': self.user_manager.has_pad(request.user),
             'is_admin': self.user_manager.is_admin(request.user),
             'apk_link': self._get_apk_link(),
-            'spotify_enabled': self.settings.spotify_enabled
+            'spotify_enabled': self.settings.spotify_enabled,
+            'compact_state': state_encoding.enabled(),
+            'state_keys': json.dumps(state_encoding.KEY_DICTIONARY),
         }
     
     def state_dict(self):
         # this function constructs a base state dictionary with website wide state
-        # pages sending states extend this state dictionary
+        # every page receives this state in addition to the state of its own topic
         return {
             'partymode': self.user_manager.partymode_enabled(),
             'users': self.user_manager.get_count(),
@@ -74,11 +84,10 @@ class Base:
             }
 
     def get_state(self, request):
-        state = self.state_dict()
-        return JsonResponse(state)
+        return state_handler.state_response(request, 'base')
 
     def update_state(self):
-        state_handler.update_state(self.state_dict())
+        state_handler.mark_dirty('base')
 
     def submit_hashtag(self, request):
         hashtag = request.POST.get('hashtag')
@@ -0,0 +1,145 @@
+from channels.exceptions import ChannelFull
+from channels.layers import BaseChannelLayer
+
+from collections import deque
+import asyncio
+import random
+import string
+import time
+
+from threading import Lock
+
+class _Channel:
+    def __init__(self):
+        # pairs of expiry time and message
+        self.messages = deque()
+        # the future of the coroutine that waits for the next message, together with its loop
+        self.waiter = None
+        self.waiter_loop = None
+
+class InProcessChannelLayer(BaseChannelLayer):
+    ''' A channel layer for deployments where daphne, the consumers and the publishing threads share one process.
+    In contrast to channels' InMemoryChannelLayer it can be used from several threads with their own event loops,
+    and messages are not copied for every receiving channel. '''
+
+    extensions = ['groups', 'flush']
+
+    def __init__(self, expiry=60, group_expiry=86400, capacity=100, channel_capacity=None, **kwargs):
+        super().__init__(expiry=expiry, capacity=capacity, channel_capacity=channel_capacity, **kwargs)
+        self.group_expiry = group_expiry
+        self.channels = {}
+        self.groups = {}
+        # every access to channels and groups is guarded, the loops that use this layer run in different threads
+        self.lock = Lock()
+
+    def _wake(self, channel):
+        ''' resolves the waiter of the channel, if there is one. Needs to be called with lock held. '''
+        waiter, loop = channel.waiter, channel.waiter_loop
+        channel.waiter = None
+        channel.waiter_loop = None
+        if waiter is None:
+            return
+        def resolve():
+            if not waiter.done():
+                waiter.set_result(None)
+        try:
+            loop.call_soon_threadsafe(resolve)
+        except RuntimeError:
+            # the loop of the receiver was closed
+            pass
+
+    def _put(self, name, message):
+        ''' appends a message to the given channel. Needs to be called with lock held. '''
+        channel = self.channels.setdefault(name, _Channel())
+        self._clean_expired(name, channel)
+        if len(channel.messages) >= self.get_capacity(name):
+            raise ChannelFull(name)
+        channel.messages.append((time.time() + self.expiry, message))
+        self._wake(channel)
+
+    def _clean_expired(self, name, channel):
+        ''' drops expired messages of the channel. A channel with expired messages is not read anymore, so it leaves its groups. '''
+        now = time.time()
+        expired = False
+        while channel.messages and channel.messages[0][0] < now:
+            channel.messages.popleft()
+            expired = True
+        if expired:
+            for members in self.groups.values():
+                members.pop(name, None)
+
+    async def send(self, channel, message):
+        assert isinstance(message, dict), 'message is not a dict'
+        assert self.valid_channel_name(channel), 'Channel name not valid'
+        assert '__asgi_channel__' not in message
+        with self.lock:
+            self._put(channel, dict(message))
+
+    async def receive(self, channel):
+        assert self.valid_channel_name(channel)
+        loop = asyncio.get_event_loop()
+        while True:
+            with self.lock:
+                entry = self.channels.setdefault(channel, _Channel())
+                self._clean_expired(channel, entry)
+                if entry.messages:
+                    _, message = entry.messages.popleft()
+                    if not entry.messages and entry.waiter is None:
+                        del self.channels[channel]
+                    return message
+                waiter = loop.create_future()
+                entry.waiter = waiter
+                entry.waiter_loop = loop
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                # the consumer stopped listening, forget about its channel
+                with self.lock:
+                    if self.channels.get(channel) is entry and entry.waiter is waiter:
+                        del self.channels[channel]
+                raise
+
+    async def new_channel(self, prefix='specific.'):
+        return '{}.inprocess!{}'.format(prefix, ''.join(random.choice(string.ascii_letters) for _ in range(12)))
+
+    async def flush(self):
+        with self.lock:
+            self.channels = {}
+            self.groups = {}
+
+    async def close(self):
+        pass
+
+    async def group_add(self, group, channel):
+        assert self.valid_group_name(group), 'Group name not valid'
+        assert self.valid_channel_name(channel), 'Channel name not valid'
+        with self.lock:
+            self.groups.setdefault(group, {})[channel] = time.time()
+
+    async def group_discard(self, group, channel):
+        assert self.valid_channel_name(channel), 'Invalid channel name'
+        assert self.valid_group_name(group), 'Invalid group name'
+        with self.lock:
+            members = self.groups.get(group)
+            if members is None:
+                return
+            members.pop(channel, None)
+            if not members:
+                del self.groups[group]
+
+    async def group_send(self, group, message):
+        assert isinstance(message, dict), 'Message is not a dict'
+        assert self.valid_group_name(group), 'Invalid group name'
+        # all members receive the same copy, consumers do not modify the messages they receive
+        message = dict(message)
+        with self.lock:
+            members = self.groups.get(group, {})
+            timeout = time.time() - self.group_expiry
+            for channel, joined in list(members.items()):
+                if joined < timeout:
+                    del members[channel]
+                    continue
+                try:
+                    self._put(channel, message)
+                except ChannelFull:
+                    pass
@@ -1,6 +1,5 @@
 from django.shortcuts import render
 from django.http import HttpResponse
-from django.http import JsonResponse
 from django.http import HttpResponseBadRequest
 from django.http import HttpResponseForbidden
 
@@ -139,6 +138,8 @@ class Lights:
             self.loop_active.clear()
         else:
             self.loop_active.set()
+        # the lights indicator is part of the base state
+        self.base.update_state()
 
     def _set_ring_program(self, program, transient=False):
         # don't allow program change on disconnected devices
@@ -212,7 +213,7 @@ class Lights:
             self.last_strip_program = self.programs[last_strip_program_name]
 
     def state_dict(self):
-        state_dict = self.base.state_dict()
+        state_dict = {}
         state_dict['ring_connected'] = self.ring.initialized
         state_dict['ring_program'] = self.ring_program.name
         state_dict['ring_brightness'] = self.ring.brightness
@@ -227,11 +228,10 @@ class Lights:
         return state_dict
 
     def get_state(self, request):
-        state = self.state_dict()
-        return JsonResponse(state)
+        return state_handler.state_response(request, 'lights')
 
     def update_state(self):
-        state_handler.update_state(self.state_dict())
+        state_handler.mark_dirty('lights')
 
     def index(self, request):
         context = self.base.context(request)
@@ -0,0 +1,110 @@
+from django.core.management.base import BaseCommand
+from channels.layers import get_channel_layer
+
+import asyncio
+import subprocess
+import threading
+import time
+import tracemalloc
+
+class Command(BaseCommand):
+    help = 'Measures the broadcast latency and memory use of the configured channel layers'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--layers', nargs='+', default=['inprocess', 'redis'], help='aliases of the channel layers to compare')
+        parser.add_argument('--clients', type=int, default=100, help='number of channels that receive each broadcast')
+        parser.add_argument('--messages', type=int, default=200, help='number of broadcasts')
+        parser.add_argument('--size', type=int, default=500, help='size of a broadcast message in bytes')
+
+    def _redis_memory(self):
+        try:
+            output = subprocess.check_output(['redis-cli', 'info', 'memory'], stderr=subprocess.DEVNULL)
+        except (FileNotFoundError, subprocess.CalledProcessError):
+            return None
+        for line in output.decode().splitlines():
+            if line.startswith('used_memory:'):
+                return int(line.split(':')[1])
+        return None
+
+    async def _receive(self, layer, channel, count, latencies):
+        for _ in range(count):
+            message = await layer.receive(channel)
+            latencies.append(time.time() - message['sent'])
+
+    def _broadcast(self, layer, messages, size):
+        # the state is published from its own thread and event loop, like the sender of the state handler
+        async def send():
+            for _ in range(messages):
+                await layer.group_send('benchmark', {'type': 'state_update', 'text': 'x' * size, 'sent': time.time()})
+                # give the receivers time to drain their channels so no broadcast exceeds the capacity
+                await asyncio.sleep(0.005)
+        loop = asyncio.new_event_loop()
+        loop.run_until_complete(send())
+        loop.close()
+
+    async def _run(self, layer, clients, messages, size):
+        channels = [await layer.new_channel() for _ in range(clients)]
+        for channel in channels:
+            await layer.group_add('benchmark', channel)
+        latencies = []
+        receivers = asyncio.gather(*[self._receive(layer, channel, messages, latencies) for channel in channels])
+        sender = threading.Thread(target=self._broadcast, args=(layer, messages, size))
+        start = time.time()
+        sender.start()
+        try:
+            await asyncio.wait_for(receivers, timeout=messages + 10)
+        except asyncio.TimeoutError:
+            pass
+        duration = time.time() - start
+        sender.join()
+        for channel in channels:
+            await layer.group_discard('benchmark', channel)
+        return latencies, duration
+
+    def handle(self, *args, **options):
+        clients = options['clients']
+        messages = options['messages']
+        expected = clients * messages
+
+        self.stdout.write('{:<12}{:>10}{:>10}{:>10}{:>10}{:>12}{:>14}'.format(
+            'layer', 'received', 'p50', 'p95', 'p99', 'msgs/s', 'memory'))
+        for alias in options['layers']:
+            try:
+                layer = get_channel_layer(alias)
+            except Exception as e:
+                self.stdout.write('{:<12}could not be created: {}'.format(alias, e))
+                continue
+            if layer is None:
+                self.stdout.write('{:<12}not configured'.format(alias))
+                continue
+
+            redis_before = self._redis_memory()
+            tracemalloc.start()
+            loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(loop)
+            try:
+                latencies, duration = loop.run_until_complete(self._run(layer, clients, messages, options['size']))
+            except Exception as e:
+                self.stdout.write('{:<12}failed: {}'.format(alias, e))
+                tracemalloc.stop()
+                continue
+            finally:
+                loop.close()
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            redis_after = self._redis_memory()
+
+            memory = '{:.1f}kB'.format(peak / 1000)
+            if alias != 'inprocess' and redis_before is not None and redis_after is not None:
+                memory += ' +{:.1f}kB redis'.format((redis_after - redis_before) / 1000)
+            if not latencies:
+                self.stdout.write('{:<12}{:>10}'.format(alias, 0))
+                continue
+            quantiles = sorted(latencies)
+            def percentile(p):
+                return '{:.2f}ms'.format(quantiles[min(len(quantiles) - 1, int(len(quantiles) * p))] * 1000)
+            self.stdout.write('{:<12}{:>10}{:>10}{:>10}{:>10}{:>12.0f}{:>14}'.format(
+                alias, '{}/{}'.format(len(latencies), expected),
+                percentile(0.5), percentile(0.95), percentile(0.99),
+                len(latencies) / duration, memory))
+        self.stdout.write('latency from group_send in a separate thread until receive, memory is the peak python allocation during the run')
@@ -0,0 +1,152 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from core.models import QueuedSong
+from core.musiq.musiq import Musiq
+from core.musiq.player import Player
+
+from types import SimpleNamespace
+from threading import Event
+from threading import Lock
+from threading import Semaphore
+import logging
+import random
+import time
+
+class _Playback:
+    # replaces the mirrored playback state, so no connection to mopidy is needed
+    def paused(self):
+        return False
+
+    def progress(self):
+        return 0
+
+def _metadata(number):
+    return {
+        'internal_url': 'file:///benchmark/{}.m4a'.format(number),
+        'external_url': 'https://www.youtube.com/watch?v=benchmark{}'.format(number),
+        'artist': 'Artist {}'.format(number),
+        'title': 'Song {}'.format(number),
+        'duration': 180,
+    }
+
+class Command(BaseCommand):
+    help = ('Measures the latency and the number of queries of the queue operations at different queue sizes. '
+            'The operations run on a temporary test database of the configured database, '
+            'run it with and without DJANGO_DEBUG to compare sqlite and postgres. Mopidy is not used.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[10, 200, 2000, 20000], help='numbers of queued songs, one run each')
+        parser.add_argument('--repetitions', type=int, default=50, help='executions of every operation per size')
+
+    def _setup(self):
+        # musiq and player without their initialization, which connects to mopidy and starts the player loop
+        self.queue = QueuedSong.objects
+        self.settings = SimpleNamespace(voting_system=False, downvotes_to_kick=10**6)
+        base = SimpleNamespace(settings=self.settings, logger=logging.getLogger('raveberry'))
+        self.musiq = Musiq.__new__(Musiq)
+        self.musiq.base = base
+        self.musiq.queue = self.queue
+        self.musiq.placeholders = []
+        self.musiq.placeholders_lock = Lock()
+        self.musiq.queue_revisions = {'queue_previous_revision': None, 'queue_revision': None, 'queue_changed_from': None}
+        self.player = Player.__new__(Player)
+        self.player.musiq = self.musiq
+        self.player.queue = self.queue
+        self.player.shuffle = False
+        self.player.repeat = False
+        self.player.autoplay = False
+        self.player.volume = 1
+        self.player.alarm_playing = Event()
+        self.player.playback = _Playback()
+        Player.queue_semaphore = Semaphore(0)
+        self.musiq.player = self.player
+        self.counter = 0
+
+    def _fill(self, size):
+        self.queue.remove_all()
+        for start in range(0, size, 1000):
+            self.queue.enqueue_many([_metadata(number) for number in range(start, min(size, start + 1000))], True)
+        self.counter = size
+
+    def _refill(self):
+        # keeps the size of the queue constant after an operation removed a song
+        self.counter += 1
+        self.queue.enqueue(_metadata(self.counter), True)
+
+    def _random_key(self):
+        return self.queue.mirror.random().id
+
+    def _random_reorder(self):
+        key = self._random_key()
+        rest = [song.id for song in self.queue.mirror.all() if song.id != key]
+        position = random.randint(0, len(rest))
+        prev = rest[position - 1] if position > 0 else None
+        next = rest[position] if position < len(rest) else None
+        return prev, key, next
+
+    def _operations(self):
+        # every operation consists of an unmeasured preparation returning the arguments, the measured function and an unmeasured cleanup
+        def select(voting, shuffle):
+            def prepare():
+                self.settings.voting_system = voting
+                self.player.shuffle = shuffle
+                return ()
+            def cleanup(result):
+                self.settings.voting_system = False
+                self.player.shuffle = False
+                self._refill()
+            return prepare, self.player._select_next, cleanup
+        def enqueue_cleanup(song):
+            self.queue.remove(song.id)
+        return [
+            ('enqueue', lambda: (_metadata(-1), True), self.queue.enqueue, enqueue_cleanup),
+            ('dequeue', lambda: (), self.queue.dequeue, lambda result: self._refill()),
+            ('prioritize', lambda: (self._random_key(),), self.queue.prioritize, None),
+            ('reorder', self._random_reorder, self.queue.reorder, None),
+            ('vote_up', lambda: (self._random_key(),), self.queue.vote_up, None),
+            ('vote_down', lambda: (self._random_key(), -self.settings.downvotes_to_kick), self.queue.vote_down, None),
+            ('remove', lambda: (self._random_key(),), self.queue.remove, lambda result: self._refill()),
+            ('state_dict', lambda: (), self.musiq.state_dict, None),
+            ('select fifo', *select(False, False)),
+            ('select voting', *select(True, False)),
+            ('select shuffle', *select(False, True)),
+        ]
+
+    def _measure(self, prepare, function, cleanup, repetitions):
+        latencies = []
+        queries = []
+        for _ in range(repetitions):
+            args = prepare()
+            with CaptureQueriesContext(connection) as context:
+                start = time.perf_counter()
+                result = function(*args)
+                latencies.append(time.perf_counter() - start)
+            queries.append(len(context.captured_queries))
+            if cleanup is not None:
+                cleanup(result)
+        latencies.sort()
+        return latencies, max(queries)
+
+    def handle(self, *args, **options):
+        old_name = connection.settings_dict['NAME']
+        self.stdout.write('creating a test database for {}'.format(connection.vendor))
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            self._setup()
+            for size in options['sizes']:
+                self._fill(size)
+                self.queue.load_mirror()
+                self.stdout.write('')
+                self.stdout.write('{} songs on {}'.format(size, connection.vendor))
+                self.stdout.write('{:<16}{:>10}{:>10}{:>10}{:>10}'.format('operation', 'p50', 'p95', 'max', 'queries'))
+                for name, prepare, function, cleanup in self._operations():
+                    latencies, queries = self._measure(prepare, function, cleanup, options['repetitions'])
+                    def milliseconds(p):
+                        return '{:.2f}ms'.format(latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000)
+                    self.stdout.write('{:<16}{:>10}{:>10}{:>10}{:>10}'.format(
+                        name, milliseconds(0.5), milliseconds(0.95), milliseconds(1), queries))
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+        self.stdout.write('queries is the highest number of database queries of a single execution')
@@ -0,0 +1,104 @@
+from django.core.management.base import BaseCommand
+from django.core.serializers.json import DjangoJSONEncoder
+
+import core.musiq.song_utils as song_utils
+import core.state_encoding as state_encoding
+import core.state_handler as state_handler
+
+import copy
+import json
+import msgpack
+import random
+import timeit
+
+def _unpack(data):
+    try:
+        return msgpack.unpackb(data, raw=False, strict_map_key=False)
+    except TypeError:
+        # msgpack < 1.0 does not know strict_map_key and accepts integer keys anyway
+        return msgpack.unpackb(data, raw=False)
+
+class Command(BaseCommand):
+    help = 'Compares the size and coding time of the json and the compact state encoding'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--songs', type=int, default=200, help='number of songs in the queue')
+        parser.add_argument('--bandwidth', type=int, default=1000, help='bandwidth per client in kbit/s used to estimate the transfer time')
+        parser.add_argument('--iterations', type=int, default=1000, help='number of repetitions for the timing measurements')
+
+    def _song(self, song_id, index):
+        duration = random.randint(120, 480)
+        video_id = ''.join(random.choice('abcdefghijklmnopqrstuvwxyz0123456789') for _ in range(11))
+        return {
+            'id': song_id,
+            'index': index,
+            'manually_requested': True,
+            'votes': random.randint(-2, 5),
+            'internal_url': 'file:///home/raveberry/Music/raveberry/' + video_id + '.m4a',
+            'external_url': 'https://www.youtube.com/watch?v=' + video_id,
+            'artist': 'Artist ' + str(song_id),
+            'title': 'A Song Title of Average Length ' + str(song_id),
+            'duration': duration,
+            'duration_formatted': song_utils.format_seconds(duration),
+            'confirmed': True,
+            'replaces': None,
+        }
+
+    def _state(self, songs):
+        song_queue = [self._song(800 + index, index + 1) for index in range(songs)]
+        current_song = self._song(799, 0)
+        del current_song['id']
+        current_song['queue_key'] = 799
+        return {
+            'current_song': current_song,
+            'paused': False,
+            'progress': 42.1337,
+            'shuffle': False,
+            'repeat': False,
+            'autoplay': False,
+            'volume': 0.8,
+            'song_queue': song_queue,
+            'total_songs': len(song_queue),
+            'total_duration': song_utils.format_seconds(sum(song['duration'] for song in song_queue)),
+        }
+
+    def _messages(self, songs):
+        state = self._state(songs)
+        messages = [('snapshot', {'topic': 'musiq', 'version': 1, 'state': state})]
+
+        voted = copy.deepcopy(state)
+        if voted['song_queue']:
+            voted['song_queue'][len(voted['song_queue']) // 2]['votes'] += 1
+        messages.append(('vote', {'topic': 'musiq', 'version': 2, 'patch': state_handler.diff(state, voted)}))
+
+        enqueued = copy.deepcopy(voted)
+        enqueued['song_queue'].append(self._song(800 + songs, songs + 1))
+        enqueued['total_songs'] += 1
+        messages.append(('enqueue', {'topic': 'musiq', 'version': 3, 'patch': state_handler.diff(voted, enqueued)}))
+        return messages
+
+    def handle(self, *args, **options):
+        iterations = options['iterations']
+        bytes_per_second = options['bandwidth'] * 1000 / 8
+
+        self.stdout.write('{:<10}{:>12}{:>12}{:>12}{:>12}{:>14}{:>14}'.format(
+            'message', 'json B', 'compact B', 'json enc', 'compact enc', 'json total', 'compact total'))
+        for name, message in self._messages(options['songs']):
+            json_text = json.dumps(message, cls=DjangoJSONEncoder)
+            compact = state_encoding.encode(message)
+
+            json_size = len(json_text.encode())
+            compact_size = len(compact)
+            # encoding happens once per broadcast, decoding on every client
+            json_encode = timeit.timeit(lambda: json.dumps(message, cls=DjangoJSONEncoder), number=iterations) / iterations
+            compact_encode = timeit.timeit(lambda: state_encoding.encode(message), number=iterations) / iterations
+            json_decode = timeit.timeit(lambda: json.loads(json_text), number=iterations) / iterations
+            compact_decode = timeit.timeit(lambda: _unpack(compact), number=iterations) / iterations
+
+            json_total = json_encode + json_size / bytes_per_second + json_decode
+            compact_total = compact_encode + compact_size / bytes_per_second + compact_decode
+            self.stdout.write('{:<10}{:>12}{:>12}{:>10.3f}ms{:>10.3f}ms{:>12.3f}ms{:>12.3f}ms'.format(
+                name, json_size, compact_size,
+                json_encode * 1000, compact_encode * 1000,
+                json_total * 1000, compact_total * 1000))
+        self.stdout.write('total: encoding + transfer at {} kbit/s + decoding (decoding measured in python)'.format(options['bandwidth']))
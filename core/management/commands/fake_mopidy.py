@@ -0,0 +1,327 @@
+from django.core.management.base import BaseCommand
+
+import asyncio
+import base64
+import hashlib
+import json
+import struct
+import time
+
+WEBSOCKET_GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+
+def _track(uri, duration):
+    name = uri.split(':')[-1].split('/')[-1]
+    return {
+        '__model__': 'Track',
+        'uri': uri,
+        'name': 'Song ' + name,
+        'artists': [{'__model__': 'Artist', 'name': 'Artist ' + name}],
+        'length': duration,
+    }
+
+class FakeMopidy:
+    ''' Simulates the parts of mopidy's json-rpc and event api that raveberry uses. Songs are not played, they just end after their duration. '''
+
+    def __init__(self, song_duration):
+        # the duration of every song in milliseconds
+        self.song_duration = song_duration
+        self.state = 'stopped'
+        self.tracklist = []
+        self.next_tlid = 1
+        self.consume = False
+        self.current = None
+        self.position = 0
+        self.position_timestamp = time.time()
+        self.volume = 50
+        self.end_handle = None
+        self.listeners = set()
+
+    def _time_position(self):
+        if self.state != 'playing':
+            return int(self.position)
+        return int(self.position + (time.time() - self.position_timestamp) * 1000)
+
+    def _set_position(self, position):
+        self.position = position
+        self.position_timestamp = time.time()
+
+    def _set_state(self, state):
+        if state != self.state:
+            old_state = self.state
+            self.state = state
+            self._emit('playback_state_changed', old_state=old_state, new_state=state)
+
+    def _schedule_end(self):
+        if self.end_handle is not None:
+            self.end_handle.cancel()
+            self.end_handle = None
+        if self.state == 'playing' and self.current is not None:
+            remaining = max(0, self.current['track']['length'] - self._time_position())
+            self.end_handle = asyncio.get_event_loop().call_later(remaining / 1000, self._track_ended)
+
+    def _track_ended(self):
+        self.end_handle = None
+        ended = self.current
+        self._emit('track_playback_ended', tl_track=ended, time_position=self._time_position())
+        self._advance(ended)
+
+    def _advance(self, ended):
+        index = self.tracklist.index(ended) if ended in self.tracklist else -1
+        if self.consume and ended in self.tracklist:
+            self.tracklist.remove(ended)
+            self._emit('tracklist_changed')
+        else:
+            index += 1
+        if 0 <= index < len(self.tracklist):
+            self._start(self.tracklist[index])
+        else:
+            self.current = None
+            self._set_position(0)
+            self._set_state('stopped')
+
+    def _start(self, tl_track):
+        self.current = tl_track
+        self._set_position(0)
+        self._set_state('playing')
+        self._emit('track_playback_started', tl_track=tl_track)
+        self._schedule_end()
+
+    def _emit(self, event, **data):
+        data['event'] = event
+        message = json.dumps(data).encode()
+        for writer in list(self.listeners):
+            _send_frame(writer, 0x1, message)
+
+    # json-rpc methods
+
+    def playback_get_state(self):
+        return self.state
+
+    def playback_get_time_position(self):
+        return self._time_position()
+
+    def playback_get_current_track(self):
+        return None if self.current is None else self.current['track']
+
+    def playback_get_current_tl_track(self):
+        return self.current
+
+    def playback_play(self, tl_track=None, tlid=None):
+        if self.state == 'paused' and tl_track is None and tlid is None:
+            return self.playback_resume()
+        if tlid is not None:
+            tl_track = next((entry for entry in self.tracklist if entry['tlid'] == tlid), None)
+        if tl_track is None:
+            tl_track = self.current if self.current is not None else (self.tracklist[0] if self.tracklist else None)
+        if tl_track is not None:
+            self._start(tl_track)
+
+    def playback_pause(self):
+        if self.state == 'playing':
+            self._set_position(self._time_position())
+            self._set_state('paused')
+            self._emit('track_playback_paused', tl_track=self.current, time_position=self._time_position())
+            self._schedule_end()
+
+    def playback_resume(self):
+        if self.state == 'paused':
+            self._set_position(self.position)
+            self._set_state('playing')
+            self._emit('track_playback_resumed', tl_track=self.current, time_position=self._time_position())
+            self._schedule_end()
+
+    def playback_stop(self):
+        if self.current is not None and self.state != 'stopped':
+            self._emit('track_playback_ended', tl_track=self.current, time_position=self._time_position())
+        self._set_position(0)
+        self._set_state('stopped')
+        self._schedule_end()
+
+    def playback_next(self):
+        if self.current is not None:
+            ended = self.current
+            self._emit('track_playback_ended', tl_track=ended, time_position=self._time_position())
+            self._advance(ended)
+
+    def playback_seek(self, time_position):
+        if self.current is None:
+            return False
+        self._set_position(max(0, time_position))
+        self._emit('seeked', time_position=int(self.position))
+        self._schedule_end()
+        return True
+
+    def tracklist_add(self, tracks=None, at_position=None, uris=None, uri=None):
+        if uri is not None:
+            uris = [uri]
+        added = []
+        for track_uri in uris or []:
+            added.append({'__model__': 'TlTrack', 'tlid': self.next_tlid, 'track': _track(track_uri, self.song_duration)})
+            self.next_tlid += 1
+        self.tracklist += added
+        self._emit('tracklist_changed')
+        return added
+
+    def tracklist_remove(self, criteria):
+        removed = [entry for entry in self.tracklist
+                   if entry['tlid'] in criteria.get('tlid', []) or entry['track']['uri'] in criteria.get('uri', [])]
+        if self.current in removed:
+            self.playback_stop()
+            self.current = None
+        self.tracklist = [entry for entry in self.tracklist if entry not in removed]
+        self._emit('tracklist_changed')
+        return removed
+
+    def tracklist_clear(self):
+        self.tracklist = []
+        self._emit('tracklist_changed')
+
+    def tracklist_set_consume(self, value):
+        self.consume = value
+
+    def tracklist_get_consume(self):
+        return self.consume
+
+    def tracklist_get_length(self):
+        return len(self.tracklist)
+
+    def tracklist_get_tl_tracks(self):
+        return self.tracklist
+
+    def mixer_get_volume(self):
+        return self.volume
+
+    def mixer_set_volume(self, volume):
+        self.volume = volume
+        self._emit('volume_changed', volume=volume)
+        return True
+
+    def library_search(self, query=None, uris=None, exact=False):
+        # every search finds exactly one song
+        if 'uri' in query:
+            uri = query['uri'][0]
+        else:
+            uri = 'spotify:track:' + hashlib.md5(' '.join(query.get('any', [''])).encode()).hexdigest()[:22]
+        return [{'__model__': 'SearchResult', 'uri': 'fake:search', 'tracks': [_track(uri, self.song_duration)]}]
+
+    def call(self, method, params):
+        name = method[len('core.'):].replace('.', '_')
+        function = getattr(self, name, None)
+        if function is None:
+            # methods that are not simulated succeed without effect
+            return None
+        if isinstance(params, dict):
+            return function(**params)
+        return function(*params)
+
+def _send_frame(writer, opcode, payload):
+    header = bytes([0x80 | opcode])
+    if len(payload) < 126:
+        header += bytes([len(payload)])
+    elif len(payload) < 1 << 16:
+        header += bytes([126]) + struct.pack('!H', len(payload))
+    else:
+        header += bytes([127]) + struct.pack('!Q', len(payload))
+    writer.write(header + payload)
+
+async def _read_frame(reader):
+    first, second = await reader.readexactly(2)
+    length = second & 0x7f
+    if length == 126:
+        length, = struct.unpack('!H', await reader.readexactly(2))
+    elif length == 127:
+        length, = struct.unpack('!Q', await reader.readexactly(8))
+    mask = await reader.readexactly(4) if second & 0x80 else bytes(4)
+    payload = bytes(byte ^ mask[i % 4] for i, byte in enumerate(await reader.readexactly(length)))
+    return first & 0x0f, payload
+
+class Command(BaseCommand):
+    help = 'Runs a stand-in for mopidy that simulates playback, used to run the server without audio hardware'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--port', type=int, default=6680, help='port of the simulated mopidy http api')
+        parser.add_argument('--song-duration', type=int, default=180, help='duration of every song in seconds')
+
+    async def _websocket(self, reader, writer, headers):
+        accept = base64.b64encode(hashlib.sha1((headers['sec-websocket-key'] + WEBSOCKET_GUID).encode()).digest()).decode()
+        writer.write((
+            'HTTP/1.1 101 Switching Protocols\r\n'
+            'Upgrade: websocket\r\n'
+            'Connection: Upgrade\r\n'
+            'Sec-WebSocket-Accept: ' + accept + '\r\n\r\n').encode())
+        self.mopidy.listeners.add(writer)
+        try:
+            while True:
+                opcode, payload = await _read_frame(reader)
+                if opcode == 0x8:
+                    _send_frame(writer, 0x8, payload[:2])
+                    break
+                if opcode == 0x9:
+                    _send_frame(writer, 0xa, payload)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self.mopidy.listeners.discard(writer)
+
+    def _respond(self, request):
+        response = {'jsonrpc': '2.0', 'id': request.get('id')}
+        try:
+            response['result'] = self.mopidy.call(request['method'], request.get('params', []))
+        except Exception as e:
+            response['error'] = {'code': -32603, 'message': 'Internal error', 'data': {'message': str(e)}}
+        return response
+
+    async def _rpc(self, reader, writer, headers):
+        body = await reader.readexactly(int(headers.get('content-length', 0)))
+        request = json.loads(body)
+        if isinstance(request, list):
+            # batches are executed in order, like mopidy does
+            response = [self._respond(entry) for entry in request]
+        else:
+            response = self._respond(request)
+        body = json.dumps(response).encode()
+        writer.write((
+            'HTTP/1.1 200 OK\r\n'
+            'Content-Type: application/json\r\n'
+            'Content-Length: ' + str(len(body)) + '\r\n\r\n').encode() + body)
+
+    async def _handle(self, reader, writer):
+        try:
+            # connections are kept alive until the client closes them
+            while True:
+                request_line = (await reader.readline()).decode()
+                if not request_line:
+                    break
+                headers = {}
+                while True:
+                    line = (await reader.readline()).decode().strip()
+                    if not line:
+                        break
+                    key, _, value = line.partition(':')
+                    headers[key.strip().lower()] = value.strip()
+                if headers.get('upgrade', '').lower() == 'websocket':
+                    await self._websocket(reader, writer, headers)
+                    break
+                elif request_line.startswith('POST'):
+                    await self._rpc(reader, writer, headers)
+                else:
+                    writer.write(b'HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\n\r\n')
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    def handle(self, *args, **options):
+        self.mopidy = FakeMopidy(options['song_duration'] * 1000)
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        server = loop.run_until_complete(asyncio.start_server(self._handle, '127.0.0.1', options['port']))
+        self.stdout.write('simulating mopidy on port {}'.format(options['port']))
+        try:
+            loop.run_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.close()
+            loop.close()
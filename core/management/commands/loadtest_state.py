@@ -0,0 +1,280 @@
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+
+import asyncio
+import json
+import os
+import random
+import time
+
+import requests
+import websockets
+
+# the topic whose state is changed by each trigger
+TRIGGER_TOPICS = {
+    'vote': 'musiq',
+    'lights': 'lights',
+    'enqueue': 'musiq',
+}
+
+def _find_server_pid():
+    # the server is the biggest process that runs daphne or the development server,
+    # wrappers like shells or timeout mention it in their command line as well
+    candidates = []
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit() or int(entry) == os.getpid():
+            continue
+        try:
+            with open(os.path.join('/proc', entry, 'cmdline'), 'rb') as f:
+                cmdline = f.read().replace(b'\0', b' ').decode(errors='ignore')
+            if 'daphne' in cmdline or 'manage.py runserver' in cmdline:
+                candidates.append((ProcessSampler(int(entry))._rss(), int(entry)))
+        except OSError:
+            continue
+    if not candidates:
+        return None
+    return max(candidates)[1]
+
+class ProcessSampler:
+    ''' Measures the cpu usage and the peak memory of the server process '''
+    def __init__(self, pid):
+        self.pid = pid
+        self.ticks_per_second = os.sysconf('SC_CLK_TCK')
+        self.peak_rss = 0
+        self.start_ticks = None
+        self.start_time = None
+
+    def _cpu_ticks(self):
+        with open('/proc/{}/stat'.format(self.pid)) as f:
+            # the command name may contain spaces, the fields after it are separated by single spaces
+            fields = f.read().rsplit(')', 1)[1].split()
+        # utime and stime
+        return int(fields[11]) + int(fields[12])
+
+    def _rss(self):
+        with open('/proc/{}/status'.format(self.pid)) as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+        return 0
+
+    def start(self):
+        self.peak_rss = self._rss()
+        self.start_ticks = self._cpu_ticks()
+        self.start_time = time.time()
+
+    def sample(self):
+        self.peak_rss = max(self.peak_rss, self._rss())
+
+    def cpu_percent(self):
+        ticks = self._cpu_ticks() - self.start_ticks
+        return 100 * ticks / self.ticks_per_second / (time.time() - self.start_time)
+
+class Measurement:
+    ''' Matches the state messages received by the clients to the triggers that caused them '''
+    def __init__(self, clients, trigger_timeout):
+        self.trigger_timeout = trigger_timeout
+        # times of the triggers per topic that did not cause a message yet
+        self.pending = {topic: [] for topic in TRIGGER_TOPICS.values()}
+        # the earliest trigger that is included in each version
+        self.origins = {}
+        self.latest = {}
+        self.received = [{} for _ in range(clients)]
+        self.latencies = []
+        self.triggers = 0
+        self.failed_triggers = 0
+        self.unanswered_triggers = 0
+        self.connection_errors = 0
+
+    def triggered(self, topic):
+        now = time.time()
+        self.triggers += 1
+        self.pending[topic].append(now)
+        return now
+
+    def trigger_failed(self, topic, triggered):
+        self.failed_triggers += 1
+        if triggered in self.pending[topic]:
+            self.pending[topic].remove(triggered)
+
+    def expire(self):
+        ''' forgets triggers that did not change the state, so they are not attributed to later messages '''
+        deadline = time.time() - self.trigger_timeout
+        for topic, pending in self.pending.items():
+            expired = [triggered for triggered in pending if triggered < deadline]
+            self.unanswered_triggers += len(expired)
+            self.pending[topic] = [triggered for triggered in pending if triggered >= deadline]
+
+    def record(self, client, message, received):
+        topic = message['topic']
+        version = message['version']
+        key = (topic, version)
+        if key not in self.origins:
+            # the first client to receive a version determines the triggers that it contains
+            pending = self.pending.get(topic, [])
+            contained = [triggered for triggered in pending if triggered <= received]
+            self.origins[key] = min(contained) if contained else None
+            self.pending[topic] = [triggered for triggered in pending if triggered > received]
+        origin = self.origins[key]
+        if origin is not None:
+            self.latencies.append(received - origin)
+        self.latest[topic] = max(self.latest.get(topic, 0), version)
+        self.received[client].setdefault(topic, set()).add(version)
+
+    def dropped(self):
+        ''' counts the versions every client should have received after its first message on a topic but did not '''
+        dropped = 0
+        for received in self.received:
+            for topic, versions in received.items():
+                dropped += self.latest[topic] - min(versions) + 1 - len(versions)
+        return dropped
+
+    def percentile(self, p):
+        if not self.latencies:
+            return None
+        latencies = sorted(self.latencies)
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p))]
+
+class Command(BaseCommand):
+    help = ('Connects simulated clients to the state websocket of a running server, changes the state through its http api '
+            'and measures how fast the changes reach the clients. '
+            'Start the server and fake_mopidy (as a stand-in for mopidy) before running this command.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='localhost:9000', help='address of the running server')
+        parser.add_argument('--clients', type=int, nargs='+', default=[10, 100, 500], help='numbers of simulated clients, one run each')
+        parser.add_argument('--duration', type=int, default=30, help='seconds the state is changed in each run')
+        parser.add_argument('--rate', type=float, default=2, help='state changes per second')
+        parser.add_argument('--triggers', nargs='+', default=['vote', 'lights'], choices=list(TRIGGER_TOPICS),
+                            help='kinds of state changes. enqueue requires spotify credentials to be configured, the search is answered by fake_mopidy')
+        parser.add_argument('--late', type=int, default=1000, help='milliseconds after which a message is counted as late')
+        parser.add_argument('--pid', type=int, help='process id of the server, found automatically if omitted')
+
+    def _post(self, path, data):
+        response = requests.post(self.http_url + path, data=data, cookies=self.cookies,
+                                 headers={'X-CSRFToken': self.cookies.get('csrftoken', '')}, timeout=10)
+        return response.status_code == 200
+
+    def _trigger(self, kind):
+        if kind == 'vote':
+            if not self.song_keys:
+                return False
+            return self._post('ajax/musiq/vote_up/', {'key': random.choice(self.song_keys)})
+        if kind == 'lights':
+            return self._post('ajax/lights/set_ring_brightness/', {'value': round(random.random(), 2)})
+        if kind == 'enqueue':
+            return self._post('ajax/musiq/request_music/', {'query': 'loadtest ' + str(random.random()), 'playlist': 'false', 'platform': 'spotify'})
+        return False
+
+    def _prepare(self):
+        # the first page load sets the csrf cookie
+        response = requests.get(self.http_url + 'musiq/', timeout=10)
+        self.cookies = response.cookies.get_dict()
+        state = requests.get(self.http_url + 'ajax/musiq/state/', timeout=10).json()
+        self.song_keys = [song['id'] for song in state['song_queue'] if 'id' in song]
+        if state['current_song'] is not None:
+            self.song_keys.append(state['current_song']['queue_key'])
+
+    async def _client(self, index, measurement, connected):
+        released = False
+        try:
+            async with websockets.connect(self.socket_url, max_size=None) as socket:
+                connected.release()
+                released = True
+                while True:
+                    data = await socket.recv()
+                    measurement.record(index, json.loads(data), time.time())
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            measurement.connection_errors += 1
+            if not released:
+                connected.release()
+
+    async def _fire(self, kind, measurement):
+        topic = TRIGGER_TOPICS[kind]
+        triggered = measurement.triggered(topic)
+        loop = asyncio.get_event_loop()
+        try:
+            ok = await loop.run_in_executor(None, self._trigger, kind)
+        except requests.RequestException:
+            ok = False
+        if not ok:
+            measurement.trigger_failed(topic, triggered)
+
+    async def _run(self, clients, options, sampler):
+        measurement = Measurement(clients, trigger_timeout=max(5, options['late'] / 1000 * 5))
+        connected = asyncio.Semaphore(0)
+        tasks = []
+        for index in range(clients):
+            tasks.append(asyncio.ensure_future(self._client(index, measurement, connected)))
+            # connect in batches, like phones joining a party
+            if index % 50 == 49:
+                for _ in range(50):
+                    await connected.acquire()
+        for _ in range(clients % 50):
+            await connected.acquire()
+        # let the clients receive their snapshots
+        await asyncio.sleep(1)
+
+        if sampler is not None:
+            sampler.start()
+        fired = []
+        end = time.time() + options['duration']
+        while time.time() < end:
+            fired.append(asyncio.ensure_future(self._fire(random.choice(options['triggers']), measurement)))
+            measurement.expire()
+            if sampler is not None:
+                sampler.sample()
+            await asyncio.sleep(1 / options['rate'])
+        await asyncio.gather(*fired)
+        # wait for the last messages to arrive
+        await asyncio.sleep(measurement.trigger_timeout)
+        measurement.expire()
+        cpu = None
+        if sampler is not None:
+            sampler.sample()
+            cpu = sampler.cpu_percent()
+
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        return measurement, cpu
+
+    def handle(self, *args, **options):
+        self.http_url = 'http://' + options['host'] + '/'
+        self.socket_url = 'ws://' + options['host'] + '/state/'
+        try:
+            self._prepare()
+        except (requests.RequestException, ValueError) as e:
+            raise CommandError('could not reach the server at {}: {}'.format(self.http_url, e))
+        if 'vote' in options['triggers'] and not self.song_keys:
+            self.stdout.write('the queue is empty, votes will not change the state')
+
+        pid = options['pid'] or _find_server_pid()
+        if pid is None:
+            self.stdout.write('server process not found, cpu and memory are not measured')
+
+        self.stdout.write('{:>8}{:>10}{:>10}{:>10}{:>10}{:>10}{:>10}{:>8}{:>9}{:>8}{:>8}{:>10}'.format(
+            'clients', 'errors', 'triggers', 'failed', 'p50', 'p95', 'p99', 'late', 'dropped', 'lost', 'cpu', 'rss'))
+        for clients in options['clients']:
+            sampler = ProcessSampler(pid) if pid is not None else None
+            loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(loop)
+            try:
+                measurement, cpu = loop.run_until_complete(self._run(clients, options, sampler))
+            finally:
+                loop.close()
+
+            def milliseconds(seconds):
+                return '-' if seconds is None else '{:.0f}ms'.format(seconds * 1000)
+            late = len([latency for latency in measurement.latencies if latency * 1000 > options['late']])
+            self.stdout.write('{:>8}{:>10}{:>10}{:>10}{:>10}{:>10}{:>10}{:>8}{:>9}{:>8}{:>8}{:>10}'.format(
+                clients, measurement.connection_errors, measurement.triggers, measurement.failed_triggers,
+                milliseconds(measurement.percentile(0.5)), milliseconds(measurement.percentile(0.95)), milliseconds(measurement.percentile(0.99)),
+                late, measurement.dropped(), measurement.unanswered_triggers,
+                '-' if cpu is None else '{:.0f}%'.format(cpu),
+                '-' if sampler is None else '{:.0f}MB'.format(sampler.peak_rss / 1024 / 1024)))
+        self.stdout.write('latency from the earliest trigger contained in a message until a client receives it. '
+                          'late: messages later than {}ms, dropped: messages that did not reach a connected client, '
+                          'lost: triggers that did not lead to any message'.format(options['late']))
@@ -0,0 +1,28 @@
+# Generated by Django 2.2.28 on 2026-10-18 20:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_remove_playlistentry_song'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='currentsong',
+            name='paused',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='currentsong',
+            name='position',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='currentsong',
+            name='position_timestamp',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,36 @@
+from django.db import migrations, models
+
+
+def normalize_queries(apps, schema_editor):
+    ArchivedQuery = apps.get_model('core', 'ArchivedQuery')
+    for archived_query in ArchivedQuery.objects.all():
+        archived_query.normalized = ' '.join(archived_query.query.lower().split())
+        archived_query.save(update_fields=['normalized'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_currentsong_position'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='archivedquery',
+            name='normalized',
+            field=models.CharField(db_index=True, default='', max_length=1000),
+            preserve_default=False,
+        ),
+        # added without auto_now, which would mark every existing query as resolved just now
+        migrations.AddField(
+            model_name='archivedquery',
+            name='resolved',
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.AlterField(
+            model_name='archivedquery',
+            name='resolved',
+            field=models.DateTimeField(auto_now=True, null=True),
+        ),
+        migrations.RunPython(normalize_queries, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.28 on 2026-10-18 20:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_archivedquery_normalized'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='archivedsong',
+            name='duration',
+            field=models.FloatField(blank=True, null=True),
+        ),
+    ]
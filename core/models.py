@@ -19,6 +19,8 @@ class ArchivedSong(models.Model):
     artist = models.CharField(max_length=1000)
     title = models.CharField(max_length=1000)
     counter = models.IntegerField()
+    # the length of the song in seconds, indexed when it was downloaded
+    duration = models.FloatField(null=True, blank=True)
     def __str__(self):
         return self.title + ' (' + self.url + '): ' + str(self.counter)
     def displayname(self):
@@ -44,8 +46,15 @@ class PlaylistEntry(models.Model):
 class ArchivedQuery(models.Model):
     song = models.ForeignKey('ArchivedSong', on_delete=models.CASCADE, related_name='queries')
     query = models.CharField(max_length=1000)
+    # used to find the song of a query that was requested before
+    normalized = models.CharField(max_length=1000, db_index=True)
+    # the last time the query was resolved to this song, None for queries from before resolutions were stored
+    resolved = models.DateTimeField(auto_now=True, null=True)
     def __str__(self):
         return self.query
+    def save(self, *args, **kwargs):
+        self.normalized = song_utils.normalize_query(self.query)
+        super().save(*args, **kwargs)
 
 class ArchivedPlaylistQuery(models.Model):
     playlist = models.ForeignKey('ArchivedPlaylist', on_delete=models.CASCADE, related_name='queries')
@@ -80,6 +89,10 @@ class CurrentSong(models.Model):
     title = models.CharField(max_length=1000)
     duration = models.IntegerField()
     created = models.DateTimeField(auto_now_add=True)
+    # the last checkpoint of the playback, used to resume the song after a restart
+    position = models.IntegerField(default=0)
+    position_timestamp = models.DateTimeField(null=True, blank=True)
+    paused = models.BooleanField(default=False)
     def __str__(self):
         return self.title + ' (' + self.internal_url + ')'
     def displayname(self):
@@ -0,0 +1,101 @@
+from django.conf import settings
+from django.db import close_old_connections
+
+from threading import Condition
+from threading import Event
+from threading import Thread
+import heapq
+import itertools
+import logging
+
+# priorities of downloads, lower values are downloaded first
+# songs that a user requested
+REQUESTED = 0
+# songs of playlists and autoplay
+BACKGROUND = 1
+
+class DownloadJob:
+    def __init__(self, key, function, priority):
+        self.key = key
+        self.function = function
+        self.priority = priority
+        # called with the result of the download, once for every request of the song
+        self.callbacks = []
+        self.started = False
+        self.done = Event()
+
+class DownloadManager:
+    ''' Downloads songs with a limited number of workers.
+    Requests for a song that is already being downloaded are attached to the running download instead of starting another one. '''
+    def __init__(self):
+        self.logger = logging.getLogger('raveberry')
+        self.changed = Condition()
+        self.queue = []
+        # jobs that are queued or running, by the id of their song
+        self.jobs = {}
+        self.counter = itertools.count()
+        self.started = False
+
+    def _start(self):
+        # called with the condition held
+        if self.started:
+            return
+        self.started = True
+        for _ in range(settings.DOWNLOAD_WORKERS):
+            Thread(target=self._work, daemon=True).start()
+
+    def submit(self, key, function, callback, priority=REQUESTED):
+        ''' queues the download of the song with the given id. function performs the download and returns whether it succeeded.
+        callback is called with this result. Returns the job, its done event is set after all callbacks were called. '''
+        with self.changed:
+            self._start()
+            job = self.jobs.get(key)
+            if job is not None:
+                job.callbacks.append(callback)
+                if not job.started and priority < job.priority:
+                    # queue the job again with the higher priority, the old entry is skipped
+                    job.priority = priority
+                    heapq.heappush(self.queue, (priority, next(self.counter), job))
+                    self.changed.notify()
+                return job
+            job = DownloadJob(key, function, priority)
+            job.callbacks.append(callback)
+            self.jobs[key] = job
+            # the counter keeps jobs of the same priority in the order they were requested
+            heapq.heappush(self.queue, (priority, next(self.counter), job))
+            self.changed.notify()
+            return job
+
+    def _work(self):
+        while True:
+            with self.changed:
+                while True:
+                    while not self.queue:
+                        self.changed.wait()
+                    priority, _, job = heapq.heappop(self.queue)
+                    if not job.started and priority == job.priority:
+                        break
+                job.started = True
+
+            # connections of a previous job may have timed out
+            close_old_connections()
+            try:
+                success = job.function()
+            except Exception as e:
+                self.logger.error('download of ' + str(job.key) + ' failed')
+                self.logger.exception(e)
+                success = False
+
+            with self.changed:
+                # later requests start a new job, which finds the downloaded file
+                del self.jobs[job.key]
+                callbacks = job.callbacks
+            for callback in callbacks:
+                try:
+                    callback(success)
+                except Exception as e:
+                    self.logger.exception(e)
+            close_old_connections()
+            job.done.set()
+
+downloads = DownloadManager()
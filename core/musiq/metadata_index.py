@@ -0,0 +1,98 @@
+from django.conf import settings
+from django.db import close_old_connections
+from django.db import transaction
+
+from core.models import ArchivedSong
+import core.musiq.song_utils as song_utils
+
+from threading import Lock
+from threading import Thread
+import logging
+import os
+
+class MetadataIndex:
+    ''' Keeps the metadata of the downloaded songs in memory, so their files are only parsed once after the download.
+    The metadata is stored with the archived songs, files that were cached before are parsed in the background. '''
+
+    # the beginning of the external urls of the indexed songs
+    external_url_prefix = 'https://www.youtube.com/watch?v='
+
+    def __init__(self):
+        self.logger = logging.getLogger('raveberry')
+        self.lock = Lock()
+        # artist, title and duration by the id of the song
+        self.entries = {}
+
+    def start(self):
+        Thread(target=self._backfill, daemon=True).start()
+
+    def get(self, song_id):
+        ''' returns the metadata of the song with the given id, or None if it was not indexed yet '''
+        with self.lock:
+            metadata = self.entries.get(song_id)
+        if metadata is None:
+            archived = ArchivedSong.objects.filter(url=self.external_url_prefix + song_id, duration__isnull=False) \
+                    .values('artist', 'title', 'duration').first()
+            if archived is None:
+                return None
+            metadata = archived
+            with self.lock:
+                self.entries[song_id] = metadata
+        return dict(metadata)
+
+    def put(self, song_id, metadata):
+        ''' indexes the metadata read from the file of the song with the given id and returns it '''
+        with self.lock:
+            self.entries[song_id] = metadata
+        # artist and title of archived songs were taken from the same file
+        # songs that are not archived yet are stored once they are enqueued
+        ArchivedSong.objects.filter(url=self.external_url_prefix + song_id).update(duration=metadata['duration'])
+        return dict(metadata)
+
+    def index(self, song_id, path):
+        ''' parses the file of the song with the given id and indexes its metadata '''
+        return self.put(song_id, song_utils.gather_metadata(path))
+
+    def _backfill(self):
+        # load every indexed song, then parse the cached files that are missing
+        close_old_connections()
+        try:
+            entries = {}
+            for url, artist, title, duration in ArchivedSong.objects \
+                    .filter(url__startswith=self.external_url_prefix, duration__isnull=False) \
+                    .values_list('url', 'artist', 'title', 'duration'):
+                entries[url[len(self.external_url_prefix):]] = {'artist': artist, 'title': title, 'duration': duration}
+            with self.lock:
+                entries.update(self.entries)
+                self.entries = entries
+
+            cache_dir = os.path.abspath(os.path.expanduser(settings.SONGS_CACHE_DIR))
+            try:
+                names = os.listdir(cache_dir)
+            except FileNotFoundError:
+                names = []
+            missing = []
+            for name in names:
+                song_id, extension = os.path.splitext(name)
+                if extension == '.m4a' and song_id not in entries:
+                    missing.append(song_id)
+            if missing:
+                self.logger.info('indexing the metadata of ' + str(len(missing)) + ' cached songs')
+
+            for start in range(0, len(missing), 100):
+                # store the metadata of a few songs in one transaction
+                with transaction.atomic():
+                    for song_id in missing[start:start + 100]:
+                        try:
+                            self.index(song_id, os.path.join(cache_dir, song_id + '.m4a'))
+                        except Exception as e:
+                            # the file may have been evicted or be corrupted, it is parsed when it is enqueued
+                            self.logger.error('could not index ' + song_id)
+                            self.logger.exception(e)
+        except Exception as e:
+            self.logger.error('could not index the cached songs')
+            self.logger.exception(e)
+        finally:
+            close_old_connections()
+
+metadata_index = MetadataIndex()
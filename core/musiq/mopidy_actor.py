@@ -0,0 +1,87 @@
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError
+from threading import Condition
+from threading import Thread
+from threading import current_thread
+import heapq
+import itertools
+import logging
+
+# priorities of commands, lower values are executed first
+# commands of the player loop, e.g. starting the next song
+IMPORTANT = 0
+# controls of the users, e.g. pausing or changing the volume
+CONTROL = 1
+# requests that only read mopidy's state
+READ = 2
+
+class _Command:
+    def __init__(self, function, key):
+        self.function = function
+        self.key = key
+        self.future = Future()
+
+class MopidyActor:
+    ''' Executes all commands to mopidy one after another in its own thread.
+    Commands are queued by priority and a queued command is replaced by a newer one with the same key. '''
+    def __init__(self):
+        self.logger = logging.getLogger('raveberry')
+        self.queue = []
+        # queued commands that may be replaced, by their key
+        self.pending = {}
+        self.counter = itertools.count()
+        self.changed = Condition()
+        self.thread = Thread(target=self._loop, daemon=True)
+        self.thread.start()
+
+    def submit(self, function, priority=CONTROL, key=None):
+        ''' queues the function and returns a future for its result.
+        If a command with the same key is still waiting, it is replaced and both callers receive the result of the new one. '''
+        with self.changed:
+            if key is not None and key in self.pending:
+                command = self.pending[key]
+                if not command.future.cancelled():
+                    command.function = function
+                    return command.future
+                # the waiting caller gave up on this command, it is skipped once it is dequeued
+            command = _Command(function, key)
+            if key is not None:
+                self.pending[key] = command
+            # the counter keeps commands of the same priority in order
+            heapq.heappush(self.queue, (priority, next(self.counter), command))
+            self.changed.notify()
+            return command.future
+
+    def run(self, function, priority=CONTROL, key=None, timeout=None):
+        ''' executes the function and returns its result.
+        Raises concurrent.futures.TimeoutError if it did not finish in time. A command that did not start until then is discarded. '''
+        if current_thread() is self.thread:
+            # called from within another command
+            return function()
+        future = self.submit(function, priority=priority, key=key)
+        try:
+            return future.result(timeout=timeout)
+        except TimeoutError:
+            future.cancel()
+            with self.changed:
+                # later commands with this key must not receive the cancelled future
+                command = self.pending.get(key)
+                if command is not None and command.future is future:
+                    del self.pending[key]
+            raise
+
+    def _loop(self):
+        while True:
+            with self.changed:
+                while not self.queue:
+                    self.changed.wait()
+                _, _, command = heapq.heappop(self.queue)
+                if command.key is not None and self.pending.get(command.key) is command:
+                    del self.pending[command.key]
+            if not command.future.set_running_or_notify_cancel():
+                continue
+            try:
+                command.future.set_result(command.function())
+            except Exception as e:
+                self.logger.error('mopidy command failed: ' + str(e))
+                command.future.set_exception(e)
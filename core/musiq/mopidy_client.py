@@ -0,0 +1,68 @@
+from json.decoder import JSONDecodeError
+from requests.exceptions import ConnectionError
+from mopidyapi import MopidyAPI
+from mopidyapi.exceptions import MopidyError
+from mopidyapi.parsedata import deserialize_mopidy, serialize_mopidy
+
+import threading
+import requests
+
+
+class MopidyClient(MopidyAPI):
+    ''' MopidyAPI that reuses its http connection and can send several calls in one json-rpc batch '''
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # requests' sessions are not thread safe, every thread keeps its own connection alive
+        self.local = threading.local()
+
+    def _post(self, data):
+        session = getattr(self.local, 'session', None)
+        if session is None:
+            session = requests.Session()
+            self.local.session = session
+        try:
+            return session.post(self.http_url, json=data).json()
+        except ConnectionError as e:
+            self.logger.error(f'Mopidy connection error: {e}')
+            raise
+        except JSONDecodeError as e:
+            self.logger.error(f'Could not decode json from Mopidy: {e}')
+            raise ConnectionError(e)
+
+    def _request(self, request_id, method, args, kwargs):
+        request = {'jsonrpc': '2.0', 'id': request_id, 'method': method}
+        if kwargs:
+            request['params'] = serialize_mopidy(kwargs)
+        elif args:
+            request['params'] = serialize_mopidy(list(args))
+        return request
+
+    def _result(self, response):
+        if 'error' in response:
+            message = response['error'].get('data', {}).get('message')
+            self.logger.error(f'Mopidy error: {message}')
+            raise MopidyError(str(message))
+        return deserialize_mopidy(response['result'])
+
+    def rpc_call(self, command: str, *args, **kwargs):
+        self.logger.debug(f'Calling Mopidy method: {command}')
+        return self._result(self._post(self._request(0, command, args, kwargs)))
+
+    def batch(self, *calls):
+        ''' executes the given calls in order with a single request and returns their results.
+        A call is the name of the method, optionally followed by a list or dict of parameters.
+        Raises MopidyError if any of the calls failed. '''
+        batch = []
+        for request_id, call in enumerate(calls):
+            if isinstance(call, str):
+                call = (call,)
+            method, params = call[0], call[1] if len(call) > 1 else []
+            if isinstance(params, dict):
+                batch.append(self._request(request_id, method, (), params))
+            else:
+                batch.append(self._request(request_id, method, params, {}))
+        responses = self._post(batch)
+        # the responses of a batch may arrive in any order
+        responses = {response.get('id'): response for response in responses}
+        return [self._result(responses[request_id]) for request_id in range(len(batch))]
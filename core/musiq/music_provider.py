@@ -4,7 +4,14 @@ from core.models import RequestLog
 from django.conf import settings
 from django.db import transaction
 from django.db.models import F
+from django.utils import timezone
 
+from django.db.models import Q
+
+from collections import Counter
+from functools import reduce
+import datetime
+import operator
 import threading
 import time
 
@@ -40,6 +47,8 @@ class MusicProvider:
         raise NotImplementedError()
 
 class SongProvider(MusicProvider):
+    # the beginning of the external urls of the songs of this provider
+    external_url_prefix = None
 
     @staticmethod
     def create(musiq, query=None, key=None, internal_url=None, external_url=None):
@@ -73,6 +82,8 @@ class SongProvider(MusicProvider):
     def __init__(self, musiq, query, key):
         super().__init__(musiq, query, key)
         self.ok_message = 'song queued'
+        # the time of the resolution if the query was answered from the archive instead of searching
+        self.archived_resolution = None
 
         if key is None:
             self.archived = False
@@ -91,10 +102,26 @@ class SongProvider(MusicProvider):
             try:
                 archived_song = ArchivedSong.objects.get(url=self.query)
             except ArchivedSong.DoesNotExist:
-                return False
+                archived_song = self._resolve_query()
+                if archived_song is None:
+                    return False
         self.id = self.__class__.get_id_from_external_url(archived_song.url)
         return True
 
+    def _resolve_query(self):
+        # returns the song that this query led to the last time it was requested, unless that was too long ago
+        if not self.query:
+            return None
+        archived_query = ArchivedQuery.objects.filter(
+                normalized=song_utils.normalize_query(self.query),
+                resolved__gte=timezone.now() - datetime.timedelta(seconds=settings.QUERY_RESOLUTION_MAX_AGE),
+                song__url__startswith=self.external_url_prefix,
+        ).select_related('song').order_by('-resolved').first()
+        if archived_query is None:
+            return None
+        self.archived_resolution = archived_query.resolved
+        return archived_query.song
+
     def enqueue(self, ip, archive=True, manually_requested=True):
         from core.musiq.player import Player
 
@@ -105,14 +132,21 @@ class SongProvider(MusicProvider):
             queryset = ArchivedSong.objects.filter(url=metadata['external_url'])
             if queryset.count() == 0:
                 initial_counter = 1 if archive else 0
-                archived_song = ArchivedSong.objects.create(url=metadata['external_url'], artist=metadata['artist'], title=metadata['title'], counter=initial_counter)
+                archived_song = ArchivedSong.objects.create(url=metadata['external_url'], artist=metadata['artist'], title=metadata['title'], duration=metadata['duration'], counter=initial_counter)
             else:
                 if archive:
                     queryset.update(counter=F('counter')+1)
                 archived_song = queryset.get()
 
             if archive:
-                ArchivedQuery.objects.get_or_create(song=archived_song, query=self.query)
+                archived_query, created = ArchivedQuery.objects.get_or_create(song=archived_song, query=self.query)
+                if self.archived_resolution is None:
+                    # the query was searched, renew its resolution
+                    if not created:
+                        archived_query.save()
+                elif created:
+                    # answers from the archive must not extend how long the query is resolved without searching
+                    ArchivedQuery.objects.filter(id=archived_query.id).update(resolved=self.archived_resolution)
 
         if archive and ip:
             RequestLog.objects.create(song=archived_song, address=ip)
@@ -126,6 +160,83 @@ class SongProvider(MusicProvider):
     def download(self, ip, background=True, archive=True, manually_requested=True):
         self.enqueue(ip, archive=archive, manually_requested=manually_requested)
 
+    def needs_download(self):
+        ''' whether the song has to be downloaded before it can be enqueued. Only valid after check_downloadable '''
+        return False
+
+    @staticmethod
+    def enqueue_many(musiq, providers, ip, archive=True, manually_requested=True):
+        ''' archives and enqueues the songs of all providers in a single transaction, the state is updated once '''
+        from core.musiq.player import Player
+
+        if not providers:
+            return []
+        metadatas = [provider.get_metadata() for provider in providers]
+        # a song may be requested several times in one batch
+        occurrences = Counter(metadata['external_url'] for metadata in metadatas)
+
+        with transaction.atomic():
+            archived_songs = {song.url: song for song in ArchivedSong.objects.filter(url__in=occurrences)}
+            new_songs = []
+            for metadata in metadatas:
+                url = metadata['external_url']
+                if url not in archived_songs:
+                    archived_songs[url] = ArchivedSong(url=url, artist=metadata['artist'], title=metadata['title'], duration=metadata['duration'],
+                                                       counter=occurrences[url] if archive else 0)
+                    new_songs.append(archived_songs[url])
+            if archive:
+                # one update for all songs that were requested equally often
+                counts = {}
+                for url, song in archived_songs.items():
+                    if song.pk is not None:
+                        counts.setdefault(occurrences[url], []).append(url)
+                for count, urls in counts.items():
+                    ArchivedSong.objects.filter(url__in=urls).update(counter=F('counter')+count)
+            ArchivedSong.objects.bulk_create(new_songs)
+            if new_songs and new_songs[0].pk is None:
+                # only some databases return the ids of created rows
+                archived_songs = {song.url: song for song in ArchivedSong.objects.filter(url__in=occurrences)}
+
+            if archive:
+                # the (song, query) pairs that were searched, and the ones answered from the archive with the time of their resolution
+                searched = set()
+                answered = {}
+                for provider, metadata in zip(providers, metadatas):
+                    pair = (archived_songs[metadata['external_url']].id, provider.query)
+                    if provider.archived_resolution is None:
+                        searched.add(pair)
+                    else:
+                        answered[pair] = provider.archived_resolution
+                for pair in searched:
+                    answered.pop(pair, None)
+                requested = searched | set(answered)
+
+                def matching(pairs):
+                    return ArchivedQuery.objects.filter(reduce(operator.or_, (Q(song_id=song_id, query=query) for song_id, query in pairs)))
+                existing = set(matching(requested).values_list('song_id', 'query'))
+                renewed = searched & existing
+                if renewed:
+                    # renew the resolution of the searched queries
+                    matching(renewed).update(resolved=timezone.now())
+                ArchivedQuery.objects.bulk_create([ArchivedQuery(song_id=song_id, query=query, normalized=song_utils.normalize_query(query))
+                                                   for song_id, query in requested - existing])
+                for pair in set(answered) - existing:
+                    # answers from the archive must not extend how long the query is resolved without searching
+                    matching([pair]).update(resolved=answered[pair])
+                if ip:
+                    RequestLog.objects.bulk_create([RequestLog(song=archived_songs[metadata['external_url']], address=ip)
+                                                    for metadata in metadatas])
+
+            songs = musiq.queue.enqueue_many(metadatas, manually_requested)
+
+        for provider, song in zip(providers, songs):
+            if provider.placeholder:
+                provider.placeholder['replaced_by'] = song.id
+        musiq.update_state()
+        for _ in songs:
+            Player.queue_semaphore.release()
+        return songs
+
     def get_suggestion(self):
         raise NotImplementedError()
 
@@ -208,6 +319,8 @@ class PlaylistProvider(MusicProvider):
         return True
 
     def _queue_songs(self, ip, archived_playlist):
+        # songs that are available right away are enqueued together
+        batch = []
         for index, entry in enumerate(archived_playlist.entries.all()):
             if index == self.musiq.base.settings.max_playlist_items:
                 break
@@ -219,15 +332,19 @@ class PlaylistProvider(MusicProvider):
                 if not song_provider.check_downloadable():
                     # song is not downloadable, continue with next song in playlist
                     continue
-                if not song_provider.download(ip, background=False, archive=False, manually_requested=False):
-                    # error during song download, continue with next song in playlist
+                if song_provider.needs_download():
+                    # enqueue the songs before this one first to keep the order of the playlist
+                    SongProvider.enqueue_many(self.musiq, batch, '', archive=False, manually_requested=False)
+                    batch = []
+                    if not song_provider.download(ip, background=False, archive=False, manually_requested=False):
+                        # error during song download, continue with next song in playlist
+                        continue
+                    if settings.DEBUG:
+                        # the sqlite database has problems if songs are pushed very fast while a new song is taken from the queue. Add a delay to mitigate.
+                        time.sleep(1)
                     continue
-            else:
-                song_provider.enqueue('', archive=False, manually_requested=False)
-
-            if settings.DEBUG:
-                # the sqlite database has problems if songs are pushed very fast while a new song is taken from the queue. Add a delay to mitigate.
-                time.sleep(1)
+            batch.append(song_provider)
+        SongProvider.enqueue_many(self.musiq, batch, '', archive=False, manually_requested=False)
 
     def enqueue(self, ip, archive=True, manually_requested=True):
         if self.key is None:
@@ -17,6 +17,7 @@ from core.musiq.player import Player
 from core.musiq.song_queue import SongQueue
 from core.musiq.youtube import YoutubeSongProvider, NoPlaylistException, YoutubePlaylistProvider
 from core.musiq.spotify import SpotifySongProvider, SpotifyPlaylistProvider
+from core.musiq.metadata_index import metadata_index
 import core.musiq.song_utils as song_utils
 import core.state_handler as state_handler
 
@@ -38,8 +39,18 @@ class Musiq:
         self.suggestions = Suggestions(self)
 
         self.queue = QueuedSong.objects
+        self.queue.load_mirror()
+        # songs that are being downloaded, changed by the request and download threads while the state is published
         self.placeholders = []
+        self.placeholders_lock = threading.Lock()
+        # the queue revisions of the published state, with which clients decide whether their loaded songs are still valid
+        self.queue_revisions = {'queue_previous_revision': None, 'queue_revision': None, 'queue_changed_from': None}
 
+        # index the metadata of songs that were cached before it was stored
+        metadata_index.start()
+
+        # mopidy's events cause state updates while the player is initialized
+        self.player = None
         self.player = Player(self)
         self.player.start()
 
@@ -61,19 +72,9 @@ class Musiq:
                 # use Youtube as a fallback
                 providers.append(YoutubePlaylistProvider(self, query, key))
         else:
-            if key is not None:
-                # an archived song was requested. The key determines the SongProvider (Youtube or Spotify)
-                provider = SongProvider.create(self, query, key)
-                if provider is None:
-                    return HttpResponseBadRequest('No provider found for requested song')
-                providers.append(provider)
-            else:
-                # try to use spotify if the user did not specifically request youtube
-                if platform is None or platform == 'spotify':
-                    if self.base.settings.spotify_enabled:
-                        providers.append(SpotifySongProvider(self, query, key))
-                # use Youtube as a fallback
-                providers.append(YoutubeSongProvider(self, query, key))
+            providers = self._song_providers(query, key, platform)
+            if providers is None:
+                return HttpResponseBadRequest('No provider found for requested song')
 
         fallback = False
         used_provider = None
@@ -98,6 +99,23 @@ class Musiq:
             message = message + ' (used fallback)'
         return HttpResponse(message)
 
+    def _song_providers(self, query, key, platform):
+        # the providers that are tried in order to find the requested song. None if an archived song could not be found
+        if key is not None:
+            # an archived song was requested. The key determines the SongProvider (Youtube or Spotify)
+            provider = SongProvider.create(self, query, key)
+            if provider is None:
+                return None
+            return [provider]
+        providers = []
+        # try to use spotify if the user did not specifically request youtube
+        if platform is None or platform == 'spotify':
+            if self.base.settings.spotify_enabled:
+                providers.append(SpotifySongProvider(self, query, key))
+        # use Youtube as a fallback
+        providers.append(YoutubeSongProvider(self, query, key))
+        return providers
+
     def request_music(self, request):
         key = request.POST.get('key')
         playlist = request.POST.get('playlist') == 'true'
@@ -134,37 +152,107 @@ class Musiq:
     def post_song(self, request):
         return self.request_music(request)
 
+    @csrf_exempt
+    def post_songs(self, request):
+        ''' enqueues every given query. Songs that do not need to be downloaded are enqueued together. '''
+        queries = request.POST.getlist('query')
+        platform = request.POST.get('platform')
+        if not queries:
+            return HttpResponseBadRequest('No songs given')
+        # every query is looked up during the request, so their number is limited like the songs of a playlist
+        if len(queries) > self.base.settings.max_playlist_items:
+            return HttpResponseBadRequest('At most {} songs can be requested at once'.format(self.base.settings.max_playlist_items))
+
+        if self.base.settings.logging_enabled:
+            ip, is_routable = ipware.get_client_ip(request)
+            if ip is None:
+                ip = ''
+        else:
+            ip = ''
+
+        batch = []
+        failed = []
+        for query in queries:
+            providers = self._song_providers(query, None, platform)
+            for i, provider in enumerate(providers):
+                if not provider.check_cached():
+                    if not provider.check_downloadable():
+                        # use the next provider, if this was the last one the song is not available
+                        if i == len(providers) - 1:
+                            failed.append(query)
+                        continue
+                    if provider.needs_download():
+                        # keep the requested order for the songs before this one
+                        SongProvider.enqueue_many(self, batch, ip)
+                        batch = []
+                        if not provider.download(ip):
+                            failed.append(query)
+                        break
+                batch.append(provider)
+                break
+        SongProvider.enqueue_many(self, batch, ip)
+
+        message = '{} songs queued'.format(len(queries) - len(failed))
+        if failed:
+            message += ', not found: ' + ', '.join(failed)
+        return HttpResponse(message)
+
     def index(self, request):
         context = self.base.context(request)
         return render(request, 'musiq.html', context)
 
+    def add_placeholder(self, placeholder):
+        with self.placeholders_lock:
+            self.placeholders.append(placeholder)
+
+    def remove_placeholder(self, placeholder):
+        with self.placeholders_lock:
+            if placeholder in self.placeholders:
+                self.placeholders.remove(placeholder)
+
+    def _queue_revisions(self):
+        # only changes when the queue changed, so unchanged queues do not cause a state update
+        mirror = self.queue.mirror
+        with mirror.lock:
+            revision = mirror.revision
+            previous = self.queue_revisions['queue_revision']
+            if revision != previous:
+                self.queue_revisions = {
+                    'queue_previous_revision': previous,
+                    'queue_revision': revision,
+                    'queue_changed_from': 0 if previous is None else mirror.changed_from(previous),
+                }
+            return self.queue_revisions
+
     def state_dict(self):
-        state_dict = self.base.state_dict()
+        state_dict = {}
         try:
             current_song = CurrentSong.objects.get()
-            current_song = model_to_dict(current_song)
+            # the playback checkpoint is only used to resume the song after a restart
+            current_song = model_to_dict(current_song, exclude=['position', 'position_timestamp', 'paused'])
         except CurrentSong.DoesNotExist:
             current_song = None
+        # only the head of the queue is sent, further songs are requested by the clients
+        # taken before the queue is read, so the published songs contain at least the changes up to this revision
+        state_dict.update(self._queue_revisions())
         song_queue = []
-        all_songs = self.queue.all()
-        if self.base.settings.voting_system:
-            all_songs = all_songs.order_by('-votes', 'index')
-        for song in all_songs:
-            song_dict = model_to_dict(song)
-            song_dict['duration_formatted'] = song_utils.format_seconds(song_dict['duration'])
-            song_dict['confirmed'] = True
-            # find the query of the placeholder that this song replaces (if any)
-            for i, placeholder in enumerate(self.placeholders[:]):
-                if placeholder['replaced_by'] == song.id:
-                    song_dict['replaces'] = placeholder['query']
-                    self.placeholders.remove(placeholder)
-                    break
-            else:
-                song_dict['replaces'] = None
-            song_queue.append(song_dict)
-        song_queue += [{'title': placeholder['query'], 'confirmed': False} for placeholder in self.placeholders]
+        with self.placeholders_lock:
+            for song in self._ordered_queue(0, settings.QUEUE_WINDOW_SIZE):
+                song_dict = self._song_dict(song)
+                # find the query of the placeholder that this song replaces (if any)
+                for placeholder in self.placeholders:
+                    if placeholder['replaced_by'] == song.id:
+                        song_dict['replaces'] = placeholder['query']
+                        self.placeholders.remove(placeholder)
+                        break
+                else:
+                    song_dict['replaces'] = None
+                song_queue.append(song_dict)
+            # placeholders of songs that were queued outside the window are not needed anymore
+            self.placeholders[:] = [placeholder for placeholder in self.placeholders if placeholder['replaced_by'] is None]
+            song_queue += [{'title': placeholder['query'], 'confirmed': False} for placeholder in self.placeholders]
 
-        if state_dict['alarm']:
+        if self.player.alarm_playing.is_set():
             state_dict['current_song'] = {
                 'queue_key': -1,
                 'manually_requested': False,
@@ -185,11 +273,40 @@ class Musiq:
         state_dict['autoplay'] =  self.player.autoplay
         state_dict['volume'] =  self.player.volume
         state_dict['song_queue'] =  song_queue
+        state_dict['total_songs'] =  self.queue.mirror.count()
+        state_dict['total_duration'] =  song_utils.format_seconds(self.queue.mirror.duration())
         return state_dict
 
+    def _ordered_queue(self, start, stop):
+        # the songs in the given range of the queue, in the order they will be played
+        return self.queue.mirror.all(voting=self.base.settings.voting_system, start=start, stop=stop)
+
+    def _song_dict(self, song):
+        song_dict = model_to_dict(song)
+        # the indices in the database have gaps, clients show the position in the queue
+        song_dict['index'] = self.queue.mirror.position(song)
+        song_dict['duration_formatted'] = song_utils.format_seconds(song_dict['duration'])
+        song_dict['confirmed'] = True
+        song_dict['replaces'] = None
+        return song_dict
+
+    def get_queue_range(self, request):
+        ''' returns the songs of the queue in the given range, used for the parts that are not part of the state '''
+        try:
+            start = int(request.GET.get('start'))
+            count = int(request.GET.get('count'))
+        except (TypeError, ValueError):
+            return HttpResponseBadRequest('start and count need to be numbers')
+        if start < 0 or count < 0:
+            return HttpResponseBadRequest('start and count need to be positive')
+        songs = self._ordered_queue(start, start + count)
+        return JsonResponse([self._song_dict(song) for song in songs], safe=False)
+
     def get_state(self, request):
-        state = self.state_dict()
-        return JsonResponse(state)
+        return state_handler.state_response(request, 'musiq')
 
     def update_state(self):
-        state_handler.update_state(self.state_dict())
+        if self.player is not None:
+            # every change might affect which song is played next
+            self.player.queue_changed()
+        state_handler.mark_dirty('musiq')
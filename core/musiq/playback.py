@@ -0,0 +1,174 @@
+from django.db import DatabaseError
+from django.utils import timezone
+
+import core.models as models
+
+from threading import Condition
+from threading import Lock
+import time
+import mopidy.core
+
+
+class PlaybackState:
+    ''' Mirrors mopidy's playback state using its events.
+    Reading the state never requires a request to mopidy, the position is interpolated from the last known one.
+    This is the only subscriber to mopidy's events, the player waits for changes of the mirror instead. '''
+
+    def __init__(self, player):
+        self.player = player
+        self.lock = Lock()
+        # notified whenever the state is changed
+        self.changed = Condition(self.lock)
+
+        self.state = mopidy.core.PlaybackState.STOPPED
+        # the tracklist id of the current track
+        self.tlid = None
+        # the length of the current track in milliseconds
+        self.duration = 0
+        # the position in milliseconds at the time of position_timestamp
+        self.known_position = 0
+        self.position_timestamp = time.time()
+        # the time of the last checkpoint of the position
+        self.last_checkpoint = 0
+
+        api = player.player
+
+        @api.on_event('playback_state_changed')
+        def on_playback_state_changed(event):
+            with self.lock:
+                # freeze the interpolated position when playback stops or pauses
+                self._set_position(self._current_position())
+                self.state = event.new_state
+                self.changed.notify_all()
+            self._changed()
+
+        @api.on_event('track_playback_started')
+        def on_track_playback_started(event):
+            with self.lock:
+                self.tlid = event.tl_track.tlid
+                self.duration = self._track_length(event.tl_track.track)
+                self._set_position(0)
+                self.state = mopidy.core.PlaybackState.PLAYING
+                self.changed.notify_all()
+            self._changed()
+
+        @api.on_event('track_playback_paused')
+        def on_track_playback_paused(event):
+            with self.lock:
+                self._set_position(event.time_position)
+                self.state = mopidy.core.PlaybackState.PAUSED
+                self.changed.notify_all()
+            self.checkpoint()
+            self._changed()
+
+        @api.on_event('track_playback_resumed')
+        def on_track_playback_resumed(event):
+            with self.lock:
+                self._set_position(event.time_position)
+                self.state = mopidy.core.PlaybackState.PLAYING
+                self.changed.notify_all()
+            self.checkpoint()
+            self._changed()
+
+        @api.on_event('seeked')
+        def on_seeked(event):
+            with self.lock:
+                self._set_position(event.time_position)
+            self.checkpoint()
+            self._changed()
+
+        @api.on_event('volume_changed')
+        def on_volume_changed(event):
+            self.player.volume = event.volume / 100
+            self._changed()
+
+    # the calls that fetch the complete playback state, they can be part of a larger batch
+    SYNC_CALLS = [
+        'core.playback.get_state',
+        'core.playback.get_time_position',
+        'core.playback.get_current_tl_track',
+    ]
+
+    def sync(self):
+        ''' fetches the complete playback state from mopidy. Needs to be executed by the mopidy actor. '''
+        self.apply(self.player.player.batch(*PlaybackState.SYNC_CALLS))
+
+    def apply(self, results):
+        ''' updates the state with the results of the SYNC_CALLS '''
+        state, position, tl_track = results
+        with self.lock:
+            self.state = state
+            if tl_track is None:
+                self.tlid = None
+                self.duration = 0
+            else:
+                self.tlid = tl_track.tlid
+                self.duration = self._track_length(tl_track.track)
+            self._set_position(position)
+            self.changed.notify_all()
+
+    def checkpoint(self):
+        ''' stores the position in the current song, so it can be resumed after a restart.
+        Called when the position can not be predicted anymore, e.g. after a seek or a pause, and periodically. '''
+        with self.lock:
+            position = int(self._current_position())
+            paused = self.state != mopidy.core.PlaybackState.PLAYING
+        self.last_checkpoint = time.time()
+        try:
+            # a single update without reading the song first
+            models.CurrentSong.objects.update(position=position, position_timestamp=timezone.now(), paused=paused)
+        except DatabaseError as e:
+            # this is called from the event thread, which must not die
+            self.player.musiq.base.logger.error('could not store the playback position: ' + str(e))
+
+    def wait_for_state(self, states, timeout=None):
+        ''' blocks until the playback is in one of the given states. Returns False if the timeout passed before. '''
+        return self.wait_until(lambda: self.state in states, timeout=timeout)
+
+    def wait_until(self, predicate, timeout=None):
+        ''' blocks until the predicate is true. It is evaluated with the lock held, whenever the state changed or notify was called. '''
+        with self.changed:
+            return self.changed.wait_for(predicate, timeout=timeout)
+
+    def notify(self):
+        ''' wakes all threads waiting for a change, so they reevaluate their predicate '''
+        with self.changed:
+            self.changed.notify_all()
+
+    def paused(self):
+        with self.lock:
+            return self.state != mopidy.core.PlaybackState.PLAYING
+
+    def position(self):
+        ''' returns the interpolated position in the current track in milliseconds '''
+        with self.lock:
+            return int(self._current_position())
+
+    def seeked(self, position):
+        ''' sets the position after a seek succeeded, before mopidy's event arrives, so following seeks start from there '''
+        with self.lock:
+            self._set_position(position)
+            self.changed.notify_all()
+
+    def progress(self):
+        with self.lock:
+            if self.duration <= 0:
+                return 0
+            return 100 * min(self._current_position(), self.duration) / self.duration
+
+    def _track_length(self, track):
+        if track is None or track.length is None:
+            return 0
+        return track.length
+
+    def _set_position(self, position):
+        self.known_position = position
+        self.position_timestamp = time.time()
+
+    def _current_position(self):
+        if self.state != mopidy.core.PlaybackState.PLAYING:
+            return self.known_position
+        return self.known_position + (time.time() - self.position_timestamp) * 1000
+
+    def _changed(self):
+        self.player.musiq.update_state()
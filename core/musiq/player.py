@@ -1,4 +1,3 @@
-from django.db import transaction
 from django.db.models import F
 from django.http import HttpResponse
 from django.http import HttpResponseForbidden
@@ -8,26 +7,28 @@ from django.conf import settings
 
 from core.models import Setting
 import core.models as models
-import core.musiq.song_utils as song_utils
 
 from threading import Semaphore
-from threading import Lock
 from threading import Event
 from threading import Thread
 from datetime import datetime
 from functools import wraps
-from contextlib import contextmanager
+from concurrent.futures import TimeoutError
 from requests.exceptions import ConnectionError
 import os
-import time
 import random
+import time
 import subprocess
 import mopidy.core
 import mopidy.backend
-from mopidyapi import MopidyAPI
 from mopidyapi.exceptions import MopidyError
 
 from core.musiq.music_provider import SongProvider
+from core.musiq.playback import PlaybackState
+from core.musiq.mopidy_client import MopidyClient
+from core.musiq.mopidy_actor import MopidyActor
+from core.musiq.mopidy_actor import IMPORTANT
+from core.musiq.mopidy_actor import READ
 
 
 class Player:
@@ -41,80 +42,73 @@ class Player:
 
         self.musiq = musiq
         self.queue = models.QueuedSong.objects
-        Player.queue_semaphore = Semaphore(self.queue.count())
+        Player.queue_semaphore = Semaphore(self.queue.mirror.count())
         self.alarm_playing = Event()
 
-        self.player = MopidyAPI()
-        self.player_lock = Lock()
-        with self.mopidy_command(important=True):
-            self.player.playback.stop()
-            self.player.tracklist.clear()
+        # the song that was added to mopidy's tracklist ahead of time, so it starts without a gap
+        self.preloaded = None
+        # set when a change of the queue might have changed the song that is played next
+        self.lookahead_outdated = False
+
+        self.player = MopidyClient()
+        # every command to mopidy is executed by this thread
+        self.commands = MopidyActor()
+        self.playback = PlaybackState(self)
+        results = self.commands.run(lambda: self.player.batch(
+            'core.playback.stop',
+            'core.tracklist.clear',
             # make songs disappear from tracklist after being played
-            self.player.tracklist.set_consume(True)
-
-        with self.mopidy_command(important=True):
-            #currentsong = self.player.currentsong()
-            self.volume = self.player.mixer.get_volume() / 100
+            ('core.tracklist.set_consume', [True]),
+            'core.mixer.get_volume',
+            *PlaybackState.SYNC_CALLS), priority=IMPORTANT)
+        self.volume = results[3] / 100
+        self.playback.apply(results[4:])
 
     def start(self):
         Thread(target=self._loop, daemon=True).start()
 
     def progress(self):
-        # the state is either pause or stop
-        current_position = 0
-        duration = 1
-        with self.mopidy_command() as allowed:
-            if allowed:
-                current_position = self.player.playback.get_time_position()
-                current_track = self.player.playback.get_current_track()
-                if current_track is None:
-                    return 0
-                duration = current_track.length
-        return 100 * current_position / duration
+        # read from the local mirror, building the state must not wait for mopidy
+        return self.playback.progress()
     def paused(self):
         # the state is either pause or stop
-        paused = False
-        with self.mopidy_command() as allowed:
-            if allowed:
-                paused = self.player.playback.get_state() != mopidy.core.PlaybackState.PLAYING
-        return paused
+        return self.playback.paused()
 
     def _loop(self):
         while True:
 
             catch_up = None
+            # whether the recovered song was paused
+            resume_paused = False
+            # whether mopidy already started the song on its own because it was preloaded
+            started = False
             if models.CurrentSong.objects.exists():
                 # recover interrupted song from database
                 current_song = models.CurrentSong.objects.get()
 
-                # continue with the current song (approximately) where we last left
-                song_provider = SongProvider.create(self.musiq, internal_url=current_song.internal_url)
-                duration = song_provider.get_metadata()['duration']
-                catch_up = round((timezone.now() - current_song.created).total_seconds() * 1000)
-                if catch_up > duration * 1000:
+                # continue with the current song where the last checkpoint left it
+                catch_up = current_song.position
+                resume_paused = current_song.paused
+                if not resume_paused:
+                    checkpoint = current_song.position_timestamp or current_song.created
+                    catch_up += round((timezone.now() - checkpoint).total_seconds() * 1000)
+                if catch_up > current_song.duration * 1000:
                     catch_up = -1
             else:
-                self.queue_semaphore.acquire()
-
-                # select the next song depending on settings
-                if self.musiq.base.settings.voting_system:
-                    with transaction.atomic():
-                        song = self.queue.all().order_by('-votes', 'index')[0]
-                        song_id = song.id
-                        self.queue.remove(song.id)
-                elif self.shuffle:
-                    index = random.randint(0,models.QueuedSong.objects.count() - 1)
-                    song_id = models.QueuedSong.objects.all()[index].id
-                    song = self.queue.remove(song_id)
-                else:
-                    # move the first song in the queue into the current song
-                    song_id, song = self.queue.dequeue()
-
-                if song is None:
-                    # either the semaphore didn't match up with the actual count of songs in the queue or a race condition occured
-                    self.musiq.base.logger.info('dequeued on empty list')
-                    continue
-                
+                if self.preloaded is not None:
+                    song_id, song = self._take_preloaded()
+                    started = song is not None
+
+                if not started:
+                    self.queue_semaphore.acquire()
+
+                    song_id, song = self._select_next()
+
+                    if song is None:
+                        # either the semaphore didn't match up with the actual count of songs in the queue or a race condition occured
+                        self.musiq.base.logger.info('dequeued on empty list')
+                        continue
+
 
                 current_song = models.CurrentSong.objects.create(
                         queue_key=song_id,
@@ -143,28 +137,39 @@ class Player:
                 except (models.ArchivedSong.DoesNotExist, models.ArchivedSong.MultipleObjectsReturned):
                     pass
 
+            # decide now whether the alarm is played after this song, so the next song is not preloaded in that case
+            alarm = random.random() < self.musiq.base.settings.alarm_probability
+
             self.musiq.update_state()
 
-            playing = Event()
-            @self.player.on_event('playback_state_changed')
-            def on_playback_state_changed(event):
-                playing.set()
-
-            with self.mopidy_command(important=True):
-                # after a restart consume may be set to False again, so make sure it is on
-                self.player.tracklist.clear()
-                self.player.tracklist.set_consume(True)
-                self.player.tracklist.add(uris=[current_song.internal_url])
-                self.player.playback.play()
-                # mopidy can only seek when the song is playing
-                playing.wait(timeout=1)
-                if catch_up is not None and catch_up >= 0:
-                    self.player.playback.seek(catch_up)
+            if not started:
+                def start_song():
+                    self.player.batch(
+                        'core.tracklist.clear',
+                        # after a restart consume may be set to False again, so make sure it is on
+                        ('core.tracklist.set_consume', [True]),
+                        ('core.tracklist.add', {'uris': [current_song.internal_url]}),
+                        'core.playback.play')
+                    self.preloaded = None
+                    # mopidy can only seek when the song is playing
+                    self.playback.wait_for_state({mopidy.core.PlaybackState.PLAYING}, timeout=1)
+                    calls = []
+                    if catch_up is not None and catch_up >= 0:
+                        calls.append(('core.playback.seek', [catch_up]))
+                    if resume_paused:
+                        calls.append('core.playback.pause')
+                    # make sure the mirrored state is correct even if an event was missed
+                    results = self.player.batch(*calls, *PlaybackState.SYNC_CALLS)
+                    self.playback.apply(results[len(calls):])
+                self.commands.run(start_song, priority=IMPORTANT)
 
-            self.musiq.update_state()
+                self.musiq.update_state()
+
+            self.playback.checkpoint()
 
             if catch_up is None or catch_up >= 0:
-                if not self._wait_until_song_end():
+                lookahead = settings.GAPLESS_LOOKAHEAD and not alarm
+                if not self._wait_until_song_end(lookahead=lookahead):
                     # there was a ConnectionError during waiting for the song to end
                     # thus, we do not delete the current song but recover its state by restarting the loop
                     continue
@@ -176,50 +181,161 @@ class Player:
                 self.queue.enqueue(song_provider.get_metadata(), False)
                 self.queue_semaphore.release()
             else:
-                # the song left the queue, we can delete big downloads
-                song_utils.decide_deletion(current_song.internal_url)
+                # the song left the queue, it may be evicted from the cache now
+                self.musiq.base.settings.song_cache.check()
 
             self.musiq.update_state()
 
-            if self.musiq.base.user_manager.partymode_enabled() and random.random() < self.musiq.base.settings.alarm_probability:
+            if self.musiq.base.user_manager.partymode_enabled() and alarm:
                 self.alarm_playing.set()
                 self.musiq.base.lights.alarm_started()
 
                 self.musiq.update_state()
+                self.musiq.base.update_state()
 
-                with self.mopidy_command(important=True):
-                    self.player.tracklist.add(uris=['file://'+os.path.join(settings.BASE_DIR, 'config/sounds/alarm.m4a')])
-                    self.player.playback.play()
-                playing.clear()
-                playing.wait(timeout=1)
+                self.commands.run(lambda: self.player.batch(
+                    ('core.tracklist.add', {'uris': ['file://'+os.path.join(settings.BASE_DIR, 'config/sounds/alarm.m4a')]}),
+                    'core.playback.play'), priority=IMPORTANT)
+                self.playback.wait_for_state({mopidy.core.PlaybackState.PLAYING}, timeout=1)
                 self._wait_until_song_end()
 
                 self.musiq.base.lights.alarm_stopped()
-                self.musiq.update_state()
                 self.alarm_playing.clear()
+                self.musiq.update_state()
+                self.musiq.base.update_state()
 
-    def _wait_until_song_end(self):
+    def _wait_until_song_end(self, lookahead=False):
         # wait until the song is over. Returns True when finished without errors, False otherwise
-        '''playback_ended = Event()
-        @self.player.on_event('tracklist_changed')
-        def on_tracklist_change(event):
-            playback_ended.set()
-        playback_ended.wait()'''
+        # With lookahead, the next song is preloaded and the song is over as soon as mopidy started the preloaded one.
         error = False
+        last_sync = time.time()
         while True:
-            with self.mopidy_command() as allowed:
-                if allowed:
-                    try:
-                        if self.player.playback.get_state() == mopidy.core.PlaybackState.STOPPED:
-                            break
-                    except (ConnectionError, MopidyError) as e:
-                        # error during state get, skip until reconnected
-                        error = True
-            time.sleep(0.1)
+            if lookahead:
+                self._update_lookahead()
+            # the mirrored state wakes us as soon as mopidy reports the end of the song
+            # or the queue changed, in which case the preloaded song is corrected in the next pass
+            remaining = max(0, last_sync + settings.PLAYBACK_POLL_INTERVAL - time.time())
+            if self.playback.wait_until(lambda: self._song_ended() or (lookahead and self.lookahead_outdated),
+                                        timeout=remaining):
+                with self.playback.lock:
+                    if self._song_ended():
+                        break
+            # the elapsed time is checked in every pass, frequent queue changes must not prevent polling and checkpoints
+            if time.time() - last_sync >= settings.PLAYBACK_POLL_INTERVAL:
+                last_sync = time.time()
+                # poll in case an event was missed, e.g. while the event connection was interrupted
+                try:
+                    self.commands.run(self.playback.sync, priority=READ, key='sync', timeout=settings.MOPIDY_COMMAND_TIMEOUT)
+                except TimeoutError:
+                    # mopidy is busy with other commands, try again later
+                    pass
+                except (ConnectionError, MopidyError) as e:
+                    # error during state get, skip until reconnected
+                    error = True
+            if time.time() - self.playback.last_checkpoint > settings.PLAYBACK_CHECKPOINT_INTERVAL:
+                # in case the position drifted from the prediction of the last checkpoint
+                self.playback.checkpoint()
         return not error
 
+    def _song_ended(self):
+        # needs to be called with the lock of the playback state held
+        if self.playback.state == mopidy.core.PlaybackState.STOPPED:
+            return True
+        return self.preloaded is not None and self.playback.tlid == self.preloaded['tlid']
+
+    def queue_changed(self):
+        ''' called whenever the queue might have changed, the song that is played next needs to be determined again '''
+        self.lookahead_outdated = True
+        self.playback.notify()
+
+    def _predict_next(self):
+        # returns the id and the url of the song that will be played after the current one
+        if self.musiq.base.settings.voting_system:
+            song = self.queue.mirror.first(voting=True)
+        elif self.shuffle:
+            # keep the random choice as long as the song is still queued
+            song = None
+            if self.preloaded is not None and self.preloaded['song_id'] is not None:
+                song = self.queue.mirror.get(self.preloaded['song_id'])
+            if song is None:
+                song = self.queue.mirror.random()
+        else:
+            song = self.queue.mirror.first()
+        if song is not None:
+            return song.id, song.internal_url
+        if self.repeat:
+            # the current song will be enqueued again as the only song
+            current_song = models.CurrentSong.objects.first()
+            if current_song is not None:
+                return None, current_song.internal_url
+        return None
+
+    def _update_lookahead(self):
+        ''' adds the song that is played next to mopidy's tracklist, replacing an outdated prediction '''
+        self.lookahead_outdated = False
+        prediction = self._predict_next()
+        if self.preloaded is not None and prediction == (self.preloaded['song_id'], self.preloaded['internal_url']):
+            return
+        def preload():
+            if self.preloaded is not None:
+                self.player.tracklist.remove({'tlid': [self.preloaded['tlid']]})
+                self.preloaded = None
+            if prediction is not None:
+                song_id, internal_url = prediction
+                tl_track = self.player.tracklist.add(uris=[internal_url])[0]
+                self.preloaded = {'song_id': song_id, 'internal_url': internal_url, 'tlid': tl_track.tlid}
+        try:
+            self.commands.run(preload, priority=IMPORTANT, timeout=settings.MOPIDY_COMMAND_TIMEOUT)
+        except TimeoutError:
+            self.lookahead_outdated = True
+        except (ConnectionError, MopidyError, IndexError):
+            # without a preloaded song the next one is started after the current one ended
+            self.preloaded = None
+
+    def _select_next(self):
+        # removes the song that is played next from the queue, depending on the settings. Returns its id and the song.
+        if self.musiq.base.settings.voting_system:
+            song = self.queue.mirror.first(voting=True)
+            song_id = None if song is None else song.id
+            return song_id, self._remove_from_queue(song_id)
+        elif self.shuffle:
+            song = self.queue.mirror.random()
+            song_id = None if song is None else song.id
+            return song_id, self._remove_from_queue(song_id)
+        else:
+            # move the first song in the queue into the current song
+            return self.queue.dequeue()
+
+    def _remove_from_queue(self, key):
+        # removes the song with the given id from the queue. Returns None if it was removed in the meantime.
+        if key is None:
+            return None
+        try:
+            return self.queue.remove(key)
+        except models.QueuedSong.DoesNotExist:
+            return None
+
+    def _take_preloaded(self):
+        # removes the song that mopidy started on its own from the queue. Returns its id and the removed song.
+        preloaded = self.preloaded
+        self.preloaded = None
+        if preloaded['song_id'] is not None:
+            song = self.queue.mirror.get(preloaded['song_id'])
+        else:
+            song = next((song for song in self.queue.mirror.all() if song.internal_url == preloaded['internal_url']), None)
+        if song is not None and song.internal_url == preloaded['internal_url'] and self.playback.tlid == preloaded['tlid']:
+            try:
+                song = self.queue.remove(song.id)
+                self.queue_semaphore.acquire(blocking=False)
+                return song.id, song
+            except models.QueuedSong.DoesNotExist:
+                pass
+        # the song was removed from the queue just when it started, play the correct one instead
+        self.commands.run(self.player.playback.stop, priority=IMPORTANT)
+        return None, None
+
     def _handle_autoplay(self, url=None):
-        if self.autoplay and models.QueuedSong.objects.count() == 0:
+        if self.autoplay and self.queue.mirror.count() == 0:
             if url is None:
                 # if no url was specified, use the one of the current song
                 try:
@@ -238,20 +354,8 @@ class Player:
                 #TODO: set platform according to provider suggestion
                 self.musiq._request_music('', suggestion, None, False, 'youtube', archive=False, manually_requested=False)
 
-
-    # wrapper method for our mopidy client that pings the mopidy server before any command and reconnects if necessary.
-    @contextmanager
-    def mopidy_command(self, important=False):
-        timeout = 3
-        if important:
-            timeout = -1
-        if self.player_lock.acquire(timeout=timeout):
-            yield True
-            self.player_lock.release()
-        else:
-            print('mopidy command could not be executed')
-            yield False
-
+    # controls are queued and executed by the mopidy actor, the response does not wait for mopidy.
+    # the mirrored playback state is updated by mopidy's events once the command was executed.
     # every control changes the views state and returns an empty response
     def control(func):
         def _decorator(self, request, *args, **kwargs):
@@ -272,45 +376,39 @@ class Player:
             return HttpResponse()
         return wraps(func)(_decorator)
 
+    def _seek(self, distance):
+        # executed by the command actor. the mirrored position saves a request to mopidy,
+        # it is updated right after the seek so repeated seeks add up without waiting for mopidy's event
+        position = max(0, self.playback.position() + distance)
+        if self.player.playback.seek(position):
+            self.playback.seeked(position)
+
     @disabled_when_voting
     @control
     def restart(self, request):
-        with self.mopidy_command() as allowed:
-            if allowed:
-                self.player.playback.seek(0)
+        # replaces queued seeks, the song is restarted either way
+        self.commands.submit(lambda: self.player.playback.seek(0), key='restart')
     @disabled_when_voting
     @control
     def seek_backward(self, request):
-        with self.mopidy_command() as allowed:
-            if allowed:
-                current_position = self.player.playback.get_time_position()
-                self.player.playback.seek(current_position - self.SEEK_DISTANCE)
+        self.commands.submit(lambda: self._seek(-self.SEEK_DISTANCE))
     @disabled_when_voting
     @control
     def play(self, request):
-        # unlikely race condition possible. but its impact is not worth the effort to prevent it
-        with self.mopidy_command() as allowed:
-            if allowed:
-                self.player.playback.play()
+        # only the latest of queued play and pause commands is executed
+        self.commands.submit(self.player.playback.play, key='play_pause')
     @disabled_when_voting
     @control
     def pause(self, request):
-        with self.mopidy_command() as allowed:
-            if allowed:
-                self.player.playback.pause()
+        self.commands.submit(self.player.playback.pause, key='play_pause')
     @disabled_when_voting
     @control
     def seek_forward(self, request):
-        with self.mopidy_command() as allowed:
-            if allowed:
-                current_position = self.player.playback.get_time_position()
-                self.player.playback.seek(current_position + self.SEEK_DISTANCE)
+        self.commands.submit(lambda: self._seek(self.SEEK_DISTANCE))
     @disabled_when_voting
     @control
     def skip(self, request):
-        with self.mopidy_command() as allowed:
-            if allowed:
-                self.player.playback.next()
+        self.commands.submit(self.player.playback.next)
     @disabled_when_voting
     @control
     def set_shuffle(self, request):
@@ -334,21 +432,17 @@ class Player:
     @control
     def set_volume(self, request):
         self.volume = float(request.POST.get('value'))
-        with self.mopidy_command() as allowed:
-            if allowed:
-                self.player.mixer.set_volume(round(self.volume * 100))
+        # only the latest volume of a slider that is dragged is set
+        volume = round(self.volume * 100)
+        self.commands.submit(lambda: self.player.mixer.set_volume(volume), key='volume')
     @disabled_when_voting
     @control
     def remove_all(self, request):
         if not self.musiq.base.user_manager.is_admin(request.user):
             return HttpResponseForbidden()
-        with self.mopidy_command() as allowed:
-            if allowed:
-                with transaction.atomic():
-                    count = self.queue.count()
-                    self.queue.all().delete()
-                for _ in range(count):
-                    self.queue_semaphore.acquire(blocking=False)
+        count = self.queue.remove_all()
+        for _ in range(count):
+            self.queue_semaphore.acquire(blocking=False)
     @disabled_when_voting
     @control
     def prioritize(self, request):
@@ -417,9 +511,8 @@ class Player:
         try:
             current_song = models.CurrentSong.objects.get()
             if current_song.queue_key == key and current_song.votes <= -self.musiq.base.settings.downvotes_to_kick:
-                with self.mopidy_command() as allowed:
-                    if allowed:
-                        self.player.playback.next()
+                # further downvotes while the skip is queued must not skip the next song as well
+                self.commands.submit(self.player.playback.next, key='kick')
         except models.CurrentSong.DoesNotExist:
             pass
 
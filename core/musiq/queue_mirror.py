@@ -0,0 +1,210 @@
+from threading import RLock
+from collections import deque
+import bisect
+import random
+
+# number of changes for which the affected positions are remembered
+CHANGE_HISTORY = 1000
+
+class QueueMirror:
+    ''' Keeps the queued songs in memory, so the queue can be read without database queries.
+    SongQueue applies every change to the mirror after it was committed, it is loaded from the database on start. '''
+
+    def __init__(self):
+        self.lock = RLock()
+        # the lowest and highest index handed out, so concurrent changes never use the same index
+        self.lowest = 0
+        self.highest = 0
+        # counts the changes of the queue
+        self.revision = 0
+        # (revision, lowest position in the queue that the change affected) of the latest changes
+        self.changes = deque(maxlen=CHANGE_HISTORY)
+        self.clear()
+
+    def clear(self):
+        with self.lock:
+            # the songs by their id
+            self.songs = {}
+            # (index, id) of every song, sorted like the queue
+            self.order = []
+            # (-votes, index, id) of every song, sorted like the queue in the voting system
+            self.voting_order = []
+            # the ids in arbitrary order and their positions in this list, to pick a random song
+            self.ids = []
+            self.positions = {}
+            self.total_duration = 0
+            self._changed(0)
+
+    def rebuild(self, songs):
+        ''' replaces the mirrored songs with the given ones '''
+        with self.lock:
+            self.clear()
+            for song in songs:
+                self.add(song)
+
+    # changes, called by SongQueue
+
+    def add(self, song):
+        with self.lock:
+            self.songs[song.id] = song
+            bisect.insort(self.order, (song.index, song.id))
+            bisect.insort(self.voting_order, (-song.votes, song.index, song.id))
+            self._changed(self._lowest_position(song))
+            self.positions[song.id] = len(self.ids)
+            self.ids.append(song.id)
+            self.total_duration += song.duration
+
+    def remove(self, key):
+        ''' removes the song with the given id. Returns the song or None if it is not queued. '''
+        with self.lock:
+            song = self.songs.get(key)
+            if song is None:
+                return None
+            self._changed(self._lowest_position(song))
+            del self.songs[key]
+            self._remove_key(self.order, (song.index, song.id))
+            self._remove_key(self.voting_order, (-song.votes, song.index, song.id))
+            # move the last id into the gap
+            position = self.positions.pop(key)
+            last = self.ids.pop()
+            if last != key:
+                self.ids[position] = last
+                self.positions[last] = position
+            self.total_duration -= song.duration
+            return song
+
+    def move(self, key, index):
+        ''' sets the index of the song with the given id '''
+        with self.lock:
+            song = self.remove(key)
+            if song is not None:
+                song.index = index
+                self.add(song)
+
+    def set_indices(self, indices):
+        ''' sets the indices of all songs at once, given by their id. The order of the songs must not change. '''
+        with self.lock:
+            for key, index in indices.items():
+                if key in self.songs:
+                    self.songs[key].index = index
+            self.order = [(self.songs[key].index, key) for _, key in self.order]
+            self.voting_order = [(votes, self.songs[key].index, key) for votes, _, key in self.voting_order]
+
+    def vote(self, key, delta):
+        ''' adds delta to the votes of the song with the given id '''
+        with self.lock:
+            song = self.songs.get(key)
+            if song is None:
+                return
+            # the votes are shown in both orders
+            self._changed(self._lowest_position(song))
+            self._remove_key(self.voting_order, (-song.votes, song.index, song.id))
+            song.votes += delta
+            bisect.insort(self.voting_order, (-song.votes, song.index, song.id))
+            self._changed(self._lowest_position(song))
+
+    def reserve_first(self, gap):
+        ''' returns an index in front of every queued song '''
+        with self.lock:
+            first = self.order[0][0] if self.order else gap
+            self.lowest = min(self.lowest, first) - gap
+            return self.lowest
+
+    def reserve_last(self, gap):
+        ''' returns an index behind every queued song '''
+        with self.lock:
+            last = self.order[-1][0] if self.order else 0
+            self.highest = max(self.highest, last) + gap
+            return self.highest
+
+    def _changed(self, position):
+        self.revision += 1
+        self.changes.append((self.revision, position))
+
+    def _lowest_position(self, song):
+        # the position of the song in the queue, in the order that is lower
+        return min(bisect.bisect_left(self.order, (song.index, song.id)),
+                   bisect.bisect_left(self.voting_order, (-song.votes, song.index, song.id)))
+
+    def _remove_key(self, keys, key):
+        position = bisect.bisect_left(keys, key)
+        if position < len(keys) and keys[position] == key:
+            del keys[position]
+
+    # queries
+
+    def changed_from(self, revision):
+        ''' returns the lowest position in the queue that was affected by a change after the given revision.
+        Returns None if the queue did not change and 0 if the changes are not remembered anymore. '''
+        with self.lock:
+            if revision == self.revision:
+                return None
+            if not self.changes or self.changes[0][0] > revision + 1:
+                return 0
+            return min(position for change_revision, position in self.changes if change_revision > revision)
+
+    def count(self):
+        return len(self.songs)
+
+    def duration(self):
+        ''' the duration of all queued songs in seconds '''
+        return self.total_duration
+
+    def get(self, key):
+        return self.songs.get(key)
+
+    def first(self, voting=False):
+        ''' returns the song that is played next, or None if the queue is empty '''
+        with self.lock:
+            keys = self.voting_order if voting else self.order
+            if not keys:
+                return None
+            return self.songs[keys[0][-1]]
+
+    def last(self):
+        with self.lock:
+            if not self.order:
+                return None
+            return self.songs[self.order[-1][-1]]
+
+    def position(self, song):
+        ''' returns the position of the song in the queue, starting at 1 '''
+        with self.lock:
+            return bisect.bisect_left(self.order, (song.index, song.id)) + 1
+
+    def following(self, song, skip=None):
+        ''' returns the song after the given one in the queue, ignoring the song skip '''
+        with self.lock:
+            position = bisect.bisect_right(self.order, (song.index, song.id))
+            while position < len(self.order):
+                key = self.order[position][1]
+                if skip is None or key != skip.id:
+                    return self.songs[key]
+                position += 1
+            return None
+
+    def preceding(self, song, skip=None):
+        ''' returns the song before the given one in the queue, ignoring the song skip '''
+        with self.lock:
+            position = bisect.bisect_left(self.order, (song.index, song.id)) - 1
+            while position >= 0:
+                key = self.order[position][1]
+                if skip is None or key != skip.id:
+                    return self.songs[key]
+                position -= 1
+            return None
+
+    def random(self):
+        ''' returns a random song, or None if the queue is empty '''
+        with self.lock:
+            if not self.ids:
+                return None
+            return self.songs[random.choice(self.ids)]
+
+    def all(self, voting=False, start=0, stop=None):
+        ''' returns the songs in the order they are played, optionally only a slice of them '''
+        with self.lock:
+            keys = self.voting_order if voting else self.order
+            return [self.songs[key[-1]] for key in keys[start:stop]]
+
+mirror = QueueMirror()
@@ -4,76 +4,135 @@ from django.db import transaction
 from django.db.models import F
 
 import core.musiq.song_utils as song_utils
+import core.musiq.queue_mirror as queue_mirror
 import core.models
 
+# the distance between the indices of consecutive songs.
+# songs are inserted between others without renumbering the queue, until there is no gap left.
+INDEX_GAP = 1024
+
 class SongQueue(models.Manager):
+    # every change is written to the database and to the mirror, reads are answered by the mirror
+    mirror = queue_mirror.mirror
+
+    def _write_through(self, function, *args):
+        # the mirror is changed once the change is visible in the database
+        transaction.on_commit(lambda: function(*args))
+
+    def load_mirror(self):
+        ''' fills the mirror with the songs in the database '''
+        self.mirror.rebuild(self.all())
+
+    def reload_mirror(self):
+        ''' fills the mirror again once the current transaction is committed, after songs were changed without the queue '''
+        transaction.on_commit(self.load_mirror)
 
     @transaction.atomic
     def enqueue(self, metadata, manually_requested):
-        last = self.last()
-        index = 1 if last is None else last.index + 1
         song = self.create(
-                index=index,
+                index=self.mirror.reserve_last(INDEX_GAP),
                 manually_requested=manually_requested,
                 internal_url=metadata['internal_url'],
                 external_url=metadata['external_url'],
                 artist=metadata['artist'],
                 title=metadata['title'],
                 duration=metadata['duration'])
+        self._write_through(self.mirror.add, song)
         return song
 
+    @transaction.atomic
+    def enqueue_many(self, metadatas, manually_requested):
+        ''' enqueues a song for every given metadata with a single insert. Returns the created songs. '''
+        songs = self.bulk_create([core.models.QueuedSong(
+                index=self.mirror.reserve_last(INDEX_GAP),
+                manually_requested=manually_requested,
+                internal_url=metadata['internal_url'],
+                external_url=metadata['external_url'],
+                artist=metadata['artist'],
+                title=metadata['title'],
+                duration=metadata['duration']) for metadata in metadatas])
+        if songs and songs[0].pk is None:
+            # only some databases return the ids of created rows, the reserved indices identify the songs
+            reserved = {song.index for song in songs}
+            songs = [song for song in self.filter(index__range=(min(reserved), max(reserved))).order_by('index')
+                     if song.index in reserved]
+        for song in songs:
+            self._write_through(self.mirror.add, song)
+        return songs
+
     @transaction.atomic
     def dequeue(self):
-        first = self.first()
-        first_id = first.id
-        if first is not None:
-            first.delete()
-        self.update(index=F('index')-1)
-        return first_id, first
+        first = self.mirror.first()
+        if first is None:
+            return None, None
+        deleted, _ = self.filter(id=first.id).delete()
+        if not deleted:
+            # the song was removed concurrently or outside of the queue, it must not stay in the mirror
+            self.mirror.remove(first.id)
+            return first.id, None
+        self._write_through(self.mirror.remove, first.id)
+        return first.id, first
 
     @transaction.atomic
     def prioritize(self, key):
         to_prioritize = self.get(id=key)
-        first = self.first()
-        if to_prioritize == first:
+        first = self.mirror.first()
+        if first is None or to_prioritize.id == first.id:
             return
 
-        self.filter(index__lt=to_prioritize.index).update(index=F('index')+1)
-        to_prioritize.index = 1
-        to_prioritize.save()
+        index = self.mirror.reserve_first(INDEX_GAP)
+        self.filter(id=key).update(index=index)
+        self._write_through(self.mirror.move, key, index)
 
 
     @transaction.atomic
     def remove(self, key):
-        to_remove = self.get(id=key)
+        try:
+            to_remove = self.get(id=key)
+        except core.models.QueuedSong.DoesNotExist:
+            # the song was deleted outside of the queue, it must not stay in the mirror
+            self.mirror.remove(key)
+            raise
         to_remove.delete()
-        if next is not None:
-            self.filter(index__gt=to_remove.index).update(index=F('index')-1)
+        self._write_through(self.mirror.remove, key)
         return to_remove
 
+    @transaction.atomic
+    def remove_all(self):
+        ''' removes every song from the queue. Returns the number of removed songs. '''
+        count, _ = self.all().delete()
+        self._write_through(self.mirror.clear)
+        return count
+
+    def _rebalance(self):
+        # spreads the indices of all songs evenly, returns the new indices by id
+        indices = {song.id: (position + 1) * INDEX_GAP for position, song in enumerate(self.mirror.all())}
+        self.bulk_update([core.models.QueuedSong(id=key, index=index) for key, index in indices.items()], ['index'])
+        self._write_through(self.mirror.set_indices, indices)
+        return indices
+
     @transaction.atomic
     def reorder(self, new_prev_id, element_id, new_next_id):
 
-        try:
-            new_prev = self.get(id=new_prev_id)
-        except core.models.QueuedSong.DoesNotExist:
-            new_prev = None
-        try:
-            to_reorder = self.get(id=element_id)
-        except core.models.QueuedSong.DoesNotExist:
+        new_prev = self.mirror.get(new_prev_id)
+        to_reorder = self.mirror.get(element_id)
+        if to_reorder is None:
             raise ValueError('reordered song does not exist')
-        try:
-            new_next = self.get(id=new_next_id)
-        except core.models.QueuedSong.DoesNotExist:
-            new_next = None
-
-        first = self.first()
-        last = self.last()
+        new_next = self.mirror.get(new_next_id)
+
+        # the queue as it looks without the reordered song
+        first = self.mirror.first()
+        if first == to_reorder:
+            first = self.mirror.following(first)
+        last = self.mirror.last()
+        if last == to_reorder:
+            last = self.mirror.preceding(last)
         # check validity of request
         if new_prev is None and new_next is None:
             # to_reorder has to be the only element in the queue
-            if first != to_reorder or last != to_reorder:
+            if first is not None or last is not None:
                 raise ValueError('reordered song is not the only one')
+            return
         if new_prev is None and new_next is not None:
             # new_next has to be the first element
             if new_next != first:
@@ -83,60 +142,39 @@ class SongQueue(models.Manager):
             if new_prev != last:
                 raise ValueError('given last is not tail of the queue')
         if new_prev is not None and new_next is not None:
-            # new_prev and new_next have to be adjacent
-            if new_next.index != new_prev.index + 1:
+            # new_prev and new_next have to be adjacent, apart from the reordered song
+            if self.mirror.following(new_prev, skip=to_reorder) != new_next:
                 raise ValueError('given pair of songs is not adjacent')
 
-        try:
-            old_prev = self.get(index=to_reorder.index-1)
-        except core.models.QueuedSong.DoesNotExist:
-            old_prev = None
-        try:
-            old_next = self.get(index=to_reorder.index+1)
-        except core.models.QueuedSong.DoesNotExist:
-            old_next = None
-
-        # update indices
-        up = True
-        if new_prev is not None:
-            if new_prev.index > to_reorder.index:
-                up = False
-        elif new_next is not None:
-            if new_next.index > to_reorder.index:
-                up = False
-
-        to_update = self.all()
-        if up:
-            if old_prev is not None:
-                to_update = to_update.filter(index__lte=old_prev.index)
-            new_index = 1
-            if new_next is not None:
-                new_index = new_next.index
-                to_update = to_update.filter(index__gte=new_next.index)
-            to_update.update(index=F('index')+1)
+        # only the reordered song gets a new index
+        if new_prev is None:
+            new_index = self.mirror.reserve_first(INDEX_GAP)
+        elif new_next is None:
+            new_index = self.mirror.reserve_last(INDEX_GAP)
         else:
-            new_index = 1
-            if new_prev is not None:
-                new_index = new_prev.index
-                to_update = to_update.filter(index__lte=new_prev.index)
-            if old_next is not None:
-                to_update = to_update.filter(index__gte=old_next.index)
-            to_update.update(index=F('index')-1)
+            prev_index, next_index = new_prev.index, new_next.index
+            if next_index - prev_index < 2:
+                indices = self._rebalance()
+                prev_index, next_index = indices[new_prev.id], indices[new_next.id]
+            new_index = (prev_index + next_index) // 2
 
-        to_reorder.index = new_index
-        to_reorder.save()
+        self.filter(id=element_id).update(index=new_index)
+        self._write_through(self.mirror.move, element_id, new_index)
 
     @transaction.atomic
     def vote_up(self, key):
         self.filter(id=key).update(votes=F('votes')+1)
+        self._write_through(self.mirror.vote, key, 1)
 
     @transaction.atomic
     def vote_down(self, key, threshold):
         self.filter(id=key).update(votes=F('votes')-1)
+        self._write_through(self.mirror.vote, key, -1)
         try:
             song = self.get(id=key)
             if song.votes <= threshold:
                 song.delete()
+                self._write_through(self.mirror.remove, key)
                 return song
         except core.models.QueuedSong.DoesNotExist:
             pass
@@ -45,19 +45,23 @@ def format_seconds(seconds):
     formatted += '{0:02d}:{1:02d}'.format(int(minutes), int(seconds))
     return formatted
 
-def get_duration(location):
-    parsed = mutagen.File(location)
-    return parsed.info.length
-
 def gather_metadata(location):
-    pass
+    ''' reads 'artist', 'title' and 'duration' from the song file at the given location.
+    Missing tags are empty, an unknown duration is -1 '''
+    parsed = mutagen.easymp4.EasyMP4(location)
+    metadata = {'artist': '', 'title': '', 'duration': -1}
+    if parsed.tags is not None:
+        if 'artist' in parsed.tags:
+            metadata['artist'] = parsed.tags['artist'][0]
+        if 'title' in parsed.tags:
+            metadata['title'] = parsed.tags['title'][0]
+    if parsed.info is not None and parsed.info.length is not None:
+        metadata['duration'] = parsed.info.length
+    return metadata
 
-def decide_deletion(location):
-    return
-    ''' takes the path to a song file and deletes it if it is larger than a threshold '''
-    '''size = os.path.getsize(location)
-    if size > settings.MAX_SONG_SIZE:
-        os.remove(location)'''
+def normalize_query(query):
+    ''' the form of a query that is used to recognize it when it is requested again '''
+    return ' '.join(query.lower().split())
 
 def displayname(artist, title):
     if artist == '':
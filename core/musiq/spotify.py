@@ -20,6 +20,8 @@ def get_web_client():
     return _web_client
 
 class SpotifySongProvider(SongProvider):
+    external_url_prefix = 'https://open.spotify.com/track/'
+
     @staticmethod
     def get_id_from_external_url(url):
         return urlparse(url).path.split('/')[-1]
@@ -82,7 +84,7 @@ class SpotifySongProvider(SongProvider):
         return 'spotify:track:' + self.id
 
     def get_external_url(self):
-        return 'https://open.spotify.com/track/' + self.id
+        return self.external_url_prefix + self.id
 
 class SpotifyPlaylistProvider(PlaylistProvider):
 
@@ -4,6 +4,8 @@ from django.db.models import F
 from django.http import HttpResponse, HttpResponseBadRequest
 
 import core.musiq.song_utils as song_utils
+import core.musiq.download_manager as download_manager
+from core.musiq.metadata_index import metadata_index
 
 import youtube_dl
 import subprocess
@@ -13,11 +15,11 @@ import errno
 import time
 import json
 import os
-import threading
-import mutagen.easymp4
 
 from urllib.parse import urlparse
 from urllib.parse import parse_qs
+from contextlib import contextmanager
+from threading import Lock
 
 from core.models import ArchivedSong, ArchivedPlaylist, PlaylistEntry, ArchivedPlaylistQuery, \
     RequestLog
@@ -52,6 +54,49 @@ def get_ydl_opts():
         'logger': MyLogger(),
     }
 
+class YoutubeDLPool:
+    ''' Reuses YoutubeDL instances for songs, creating one loads all extractors.
+    An instance is used by one thread at a time, new ones are created when all are in use. '''
+    def __init__(self):
+        self.lock = Lock()
+        self.idle = []
+
+    @contextmanager
+    def get(self):
+        with self.lock:
+            ydl = self.idle.pop() if self.idle else None
+        if ydl is None:
+            ydl = youtube_dl.YoutubeDL(get_ydl_opts())
+        try:
+            yield ydl
+        finally:
+            with self.lock:
+                self.idle.append(ydl)
+
+ydl_pool = YoutubeDLPool()
+
+class InfoCache:
+    ''' Keeps the extracted information of videos for a short time, so a download does not resolve its video again '''
+    def __init__(self):
+        self.lock = Lock()
+        # (time of extraction, info_dict) by video id
+        self.entries = {}
+
+    def get(self, video_id):
+        with self.lock:
+            entry = self.entries.get(video_id)
+        if entry is None or time.time() - entry[0] > settings.YOUTUBE_INFO_TTL:
+            return None
+        return entry[1]
+
+    def put(self, info_dict):
+        now = time.time()
+        with self.lock:
+            self.entries = {video_id: entry for video_id, entry in self.entries.items() if now - entry[0] <= settings.YOUTUBE_INFO_TTL}
+            self.entries[info_dict['id']] = (now, info_dict)
+
+info_cache = InfoCache()
+
 def get_initial_data(html):
     for line in html.split('\n'):
         line = line.strip()
@@ -71,6 +116,8 @@ class Downloader:
         self.ydl_opts = get_ydl_opts()
 
 class YoutubeSongProvider(SongProvider):
+    external_url_prefix = 'https://www.youtube.com/watch?v='
+
     @staticmethod
     def get_id_from_external_url(url):
         return parse_qs(urlparse(url).query)['v'][0]
@@ -83,7 +130,6 @@ class YoutubeSongProvider(SongProvider):
         super().__init__(musiq, query, key)
         self.type = 'youtube'
         self.info_dict = None
-        self.ydl_opts = get_ydl_opts()
 
     def check_cached(self):
         # TODO: in case query is set but key and id is not, try to extract the id from the query
@@ -94,15 +140,25 @@ class YoutubeSongProvider(SongProvider):
 
     def check_downloadable(self):
         try:
-            with youtube_dl.YoutubeDL(self.ydl_opts) as ydl:
-                self.info_dict = ydl.extract_info(self.query, download=False)
-        except youtube_dl.utils.DownloadError as e:
-            self.error = e
-            return False
+            video_id = self.get_id_from_external_url(self.query)
+        except (KeyError, TypeError):
+            video_id = None
+        if video_id is None and self.id is not None:
+            # the query was resolved from the archive, no need to search again
+            video_id = self.id
+        self.info_dict = None if video_id is None else info_cache.get(video_id)
+        if self.info_dict is None:
+            try:
+                with ydl_pool.get() as ydl:
+                    self.info_dict = ydl.extract_info(self.query if video_id is None else self.external_url_prefix + video_id, download=False)
+            except youtube_dl.utils.DownloadError as e:
+                self.error = e
+                return False
 
-        # this value is not an exact match, but it's a good approximation
-        if 'entries' in self.info_dict:
-            self.info_dict = self.info_dict['entries'][0]
+            # this value is not an exact match, but it's a good approximation
+            if 'entries' in self.info_dict:
+                self.info_dict = self.info_dict['entries'][0]
+            info_cache.put(self.info_dict)
 
         self.id = self.info_dict['id']
 
@@ -113,19 +169,23 @@ class YoutubeSongProvider(SongProvider):
             return False
         return True
 
-    def _download(self, ip, archive, manually_requested):
+    def _download(self):
+        # downloads the song into the cache, executed by the download manager. Returns whether it succeeded.
         error = None
         location = None
 
-        self.placeholder = {'query': self.query, 'replaced_by': None}
-        self.musiq.placeholders.append(self.placeholder)
-        self.musiq.update_state()
-
+        info_dict = self.info_dict or info_cache.get(self.id)
         try:
-            with youtube_dl.YoutubeDL(self.ydl_opts) as ydl:
-                ydl.download([self.get_external_url()])
+            with ydl_pool.get() as ydl:
+                if info_dict is not None:
+                    # the video was resolved when checking whether it can be downloaded
+                    ydl.process_ie_result(info_dict, download=True)
+                else:
+                    ydl.download([self.get_external_url()])
 
             location = self.get_path()
+            # parse the file once, enqueueing the song uses the indexed metadata
+            metadata_index.index(self.id, location)
             base = os.path.splitext(location)[0]
             thumbnail = base + '.jpg'
             try:
@@ -140,45 +200,51 @@ class YoutubeSongProvider(SongProvider):
             self.musiq.logger.error('accessible video could not be downloaded: ' + str(self.id))
             self.musiq.logger.error(error)
             self.musiq.logger.error('location: ' + str(location))
-            self.musiq.placeholders.remove(self.placeholder)
-            self.musiq.update_state()
-            return
-        self.enqueue(ip, archive=archive, manually_requested=manually_requested)
+            return False
+        return True
 
     def download(self, ip, background=True, archive=True, manually_requested=True):
         # check if file was already downloaded and only download if necessary
         if os.path.isfile(self.get_path()):
             self.enqueue(ip, archive=archive, manually_requested=manually_requested)
-        else:
-            thread = threading.Thread(target=self._download, args=(ip, archive, manually_requested), daemon=True)
-            thread.start()
-            if not background:
-                thread.join()
+            return True
+
+        self.placeholder = {'query': self.query, 'replaced_by': None}
+        self.musiq.add_placeholder(self.placeholder)
+        self.musiq.update_state()
+
+        def downloaded(success):
+            if success:
+                # the cache grew, it may need to be reduced
+                self.musiq.base.settings.song_cache.check()
+                self.enqueue(ip, archive=archive, manually_requested=manually_requested)
+            else:
+                self.musiq.remove_placeholder(self.placeholder)
+                self.musiq.update_state()
+
+        # songs that guests wait for are downloaded before the ones of playlists and autoplay
+        priority = download_manager.REQUESTED if manually_requested else download_manager.BACKGROUND
+        job = download_manager.downloads.submit(self.id, self._download, downloaded, priority)
+        if not background:
+            job.done.wait()
         return True
 
+    def needs_download(self):
+        return not os.path.isfile(self.get_path())
+
     def get_metadata(self):
         '''gathers the metadata for the song at the given location.
-        'title' and 'duration' is read from tags, the 'url' is built from the location'''
+        'artist', 'title' and 'duration' are taken from the metadata index, the file is only read if it was not indexed yet'''
 
-        parsed = mutagen.easymp4.EasyMP4(self.get_path())
-        metadata = dict()
+        metadata = metadata_index.get(self.id)
+        if metadata is None:
+            metadata = metadata_index.index(self.id, self.get_path())
 
         metadata['internal_url'] = self.get_internal_url()
         metadata['external_url'] = 'https://www.youtube.com/watch?v=' + self.id
 
-        if parsed.tags is not None:
-            if 'artist' in parsed.tags:
-                metadata['artist'] = parsed.tags['artist'][0]
-            if 'title' in parsed.tags:
-                metadata['title'] = parsed.tags['title'][0]
-        if 'artist' not in metadata:
-            metadata['artist'] = ''
-        if 'title' not in metadata:
+        if metadata['title'] == '':
             metadata['title'] = metadata['external_url']
-        if parsed.info is not None and parsed.info.length is not None:
-            metadata['duration'] = parsed.info.length
-        else:
-            metadata['duration'] = -1
 
         return metadata
 
@@ -192,7 +258,7 @@ class YoutubeSongProvider(SongProvider):
         return 'file://' + self.get_path()
 
     def get_external_url(self):
-        return 'https://www.youtube.com/watch?v=' + self.id
+        return self.external_url_prefix + self.id
 
     def get_suggestion(self):
         session = requests.session()
@@ -2,7 +2,6 @@ from django.db import transaction
 from django.shortcuts import render
 from django.core.exceptions import PermissionDenied
 from django.http import HttpResponse
-from django.http import JsonResponse
 from django.http import HttpResponseBadRequest
 
 from core import models
@@ -14,16 +13,15 @@ class Pad:
         self.base = base
 
     def state_dict(self):
-        state_dict = self.base.state_dict()
+        state_dict = {}
         state_dict['pad_version'] = models.Pad.objects.get(id=1).version
         return state_dict
 
     def get_state(self, request):
-        state = self.state_dict()
-        return JsonResponse(state)
+        return state_handler.state_response(request, 'pad')
 
     def update_state(self):
-        state_handler.update_state(self.state_dict())
+        state_handler.mark_dirty('pad')
 
     def index(self, request):
         if not self.base.user_manager.has_pad(request.user):
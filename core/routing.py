@@ -3,4 +3,5 @@ from core import state_handler
 
 websocket_urlpatterns = [
     url(r'^state/$', state_handler.StateConsumer),
+    url(r'^state/(?P<topic>\w+)/$', state_handler.StateConsumer),
 ]
@@ -12,6 +12,8 @@ from django.conf import settings
 from core.models import Setting
 from core.models import PlayLog
 from core.models import RequestLog
+from core.system_status import SystemStatus
+from core.song_cache import SongCache
 import core.state_handler as state_handler
 import core.musiq.song_utils as song_utils
 
@@ -39,6 +41,7 @@ class Settings:
         self.downvotes_to_kick = int(Setting.objects.get_or_create(key='downvotes_to_kick', defaults={'value': 3})[0].value)
         self.max_download_size = int(Setting.objects.get_or_create(key='max_download_size', defaults={'value': 10})[0].value)
         self.max_playlist_items = int(Setting.objects.get_or_create(key='max_playlist_items', defaults={'value': 10})[0].value)
+        self.song_cache_size = int(Setting.objects.get_or_create(key='song_cache_size', defaults={'value': 0})[0].value)
         self.spotify_username = Setting.objects.get_or_create(key='spotify_username', defaults={'value': ''})[0].value
         self.spotify_password = Setting.objects.get_or_create(key='spotify_password', defaults={'value': ''})[0].value
         self.spotify_client_id = Setting.objects.get_or_create(key='spotify_client_id', defaults={'value': ''})[0].value
@@ -51,8 +54,13 @@ class Settings:
         self.bluetooth_devices = []
         self.homewifi = Setting.objects.get_or_create(key='homewifi', defaults={'value': ''})[0].value
 
+        self.system_status = SystemStatus(self)
+        self.system_status.start()
+        self.song_cache = SongCache(self)
+        self.song_cache.start()
+
     def state_dict(self):
-        state_dict = self.base.state_dict()
+        state_dict = {}
         state_dict['voting_system'] = self.voting_system
         state_dict['logging_enabled'] = self.logging_enabled
         state_dict['people_to_party'] = self.people_to_party
@@ -60,6 +68,7 @@ class Settings:
         state_dict['downvotes_to_kick'] = self.downvotes_to_kick
         state_dict['max_download_size'] = self.max_download_size
         state_dict['max_playlist_items'] = self.max_playlist_items
+        state_dict['song_cache_size'] = self.song_cache_size
         state_dict['has_internet'] = self.has_internet
 
         state_dict['spotify_credentials_valid'] = self.spotify_enabled
@@ -67,30 +76,17 @@ class Settings:
         state_dict['bluetooth_scanning'] = self.bluetoothctl is not None
         state_dict['bluetooth_devices'] = self.bluetooth_devices
 
-        try:
-            with open(os.path.join(settings.BASE_DIR, 'config/homewifi')) as f:
-                state_dict['homewifi_ssid'] = f.read()
-        except FileNotFoundError:
-            state_dict['homewifi_ssid'] = ''
-
-        try:
-            state_dict['homewifi_enabled'] = subprocess.call(['/usr/local/sbin/raveberry/homewifi_enabled']) != 0
-            state_dict['events_enabled'] = subprocess.call(['/usr/local/sbin/raveberry/events_enabled']) != 0
-            state_dict['hotspot_enabled'] = subprocess.call(['/usr/local/sbin/raveberry/hotspot_enabled']) != 0
-            state_dict['wifi_protected'] = subprocess.call(['/usr/local/sbin/raveberry/wifi_protected']) != 0
-            state_dict['tunneling_enabled'] = subprocess.call(['sudo', '/usr/local/sbin/raveberry/tunneling_enabled']) != 0
-            state_dict['remote_enabled'] = subprocess.call(['/usr/local/sbin/raveberry/remote_enabled']) != 0
-        except FileNotFoundError:
-            self.base.logger.error('scripts not installed')
+        # probing the system is expensive, use the values cached in the background
+        state_dict.update(self.system_status.state_dict())
+        state_dict.update(self.song_cache.state_dict())
 
         return state_dict
 
     def get_state(self, request):
-        state = self.state_dict()
-        return JsonResponse(state)
+        return state_handler.state_response(request, 'settings')
 
     def update_state(self):
-        state_handler.update_state(self.state_dict())
+        state_handler.mark_dirty('settings')
 
     def index(self, request):
         if not self.base.user_manager.is_admin(request.user):
@@ -178,6 +174,8 @@ class Settings:
                 return HttpResponseForbidden()
             response = func(self, request, *args, **kwargs)
             self.update_state()
+            # some settings (e.g. spotify) are reflected in the base state
+            self.base.update_state()
             if response is not None:
                 return response
             return HttpResponse()
@@ -219,6 +217,12 @@ class Settings:
         Setting.objects.filter(key='max_playlist_items').update(value=value)
         self.max_playlist_items = value
     @option
+    def set_song_cache_size(self, request):
+        value = int(request.POST.get('value'))
+        Setting.objects.filter(key='song_cache_size').update(value=value)
+        self.song_cache_size = value
+        self.song_cache.check()
+    @option
     def check_internet(self, request):
         self._check_internet()
     @option
@@ -410,9 +414,11 @@ class Settings:
     @option
     def disable_homewifi(self, request):
         subprocess.call(['sudo', '/usr/local/sbin/raveberry/disable_homewifi'])
+        self.system_status.invalidate('homewifi_enabled')
     @option
     def enable_homewifi(self, request):
         subprocess.call(['sudo', '/usr/local/sbin/raveberry/enable_homewifi'])
+        self.system_status.invalidate('homewifi_enabled')
     @option
     def stored_ssids(self, request):
         output = subprocess.check_output(['sudo', '/usr/local/sbin/raveberry/list_stored_ssids'])
@@ -424,6 +430,7 @@ class Settings:
         homewifi_ssid = request.POST.get('homewifi_ssid')
         with open(os.path.join(settings.BASE_DIR, 'config/homewifi'), 'w+') as f:
             f.write(homewifi_ssid)
+        self.system_status.invalidate('homewifi_ssid')
 
     @option
     def analyse(self, request):
@@ -503,33 +510,43 @@ class Settings:
     @option
     def disable_events(self, request):
         subprocess.call(['sudo', '/usr/local/sbin/raveberry/disable_events'])
+        self.system_status.invalidate('events_enabled')
     @option
     def enable_events(self, request):
         subprocess.call(['sudo', '/usr/local/sbin/raveberry/enable_events'])
+        self.system_status.invalidate('events_enabled')
     @option
     def disable_hotspot(self, request):
         subprocess.call(['sudo', '/usr/local/sbin/raveberry/disable_hotspot'])
+        self.system_status.invalidate('hotspot_enabled')
     @option
     def enable_hotspot(self, request):
         subprocess.call(['sudo', '/usr/local/sbin/raveberry/enable_hotspot'])
+        self.system_status.invalidate('hotspot_enabled')
     @option
     def unprotect_wifi(self, request):
         subprocess.call(['sudo', '/usr/local/sbin/raveberry/unprotect_wifi'])
+        self.system_status.invalidate('wifi_protected')
     @option
     def protect_wifi(self, request):
         subprocess.call(['sudo', '/usr/local/sbin/raveberry/protect_wifi'])
+        self.system_status.invalidate('wifi_protected')
     @option
     def disable_tunneling(self, request):
         subprocess.call(['sudo', '/usr/local/sbin/raveberry/disable_tunneling'])
+        self.system_status.invalidate('tunneling_enabled')
     @option
     def enable_tunneling(self, request):
         subprocess.call(['sudo', '/usr/local/sbin/raveberry/enable_tunneling'])
+        self.system_status.invalidate('tunneling_enabled')
     @option
     def disable_remote(self, request):
         subprocess.call(['sudo', '/usr/local/sbin/raveberry/disable_remote'])
+        self.system_status.invalidate('remote_enabled')
     @option
     def enable_remote(self, request):
         subprocess.call(['sudo', '/usr/local/sbin/raveberry/enable_remote'])
+        self.system_status.invalidate('remote_enabled')
     @option
     def reboot_server(self, request):
         subprocess.call(['sudo', '/usr/local/sbin/raveberry/reboot_server'])
@@ -0,0 +1,178 @@
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import Max
+from django.utils import timezone
+
+from core.models import ArchivedSong
+from core.models import CurrentSong
+from core.musiq.queue_mirror import mirror
+import core.musiq.song_utils as song_utils
+
+import threading
+import logging
+import time
+import os
+
+class SongCache:
+    ''' Keeps the downloaded songs within the configured budget, checked in the background.
+    Once the cache grows beyond the high watermark of the budget, songs are deleted until it is below the low watermark.
+    Songs that are queued or playing are never deleted. '''
+
+    def __init__(self, settings_page):
+        self.settings_page = settings_page
+        self.logger = logging.getLogger('raveberry')
+
+        self.lock = threading.Lock()
+        self.used = 0
+        self.files = 0
+        self.evicted = 0
+
+        # check the cache once on startup
+        self.wakeup = threading.Event()
+        self.wakeup.set()
+
+    def start(self):
+        threading.Thread(target=self._loop, daemon=True).start()
+
+    def check(self):
+        ''' schedules a check of the cache, e.g. after a song was downloaded or left the queue '''
+        self.wakeup.set()
+
+    def state_dict(self):
+        with self.lock:
+            return {
+                'song_cache_used': self.used // (1024 * 1024),
+                'song_cache_files': self.files,
+                'song_cache_evicted': self.evicted,
+            }
+
+    def _loop(self):
+        while True:
+            self.wakeup.wait(timeout=settings.SONG_CACHE_CHECK_INTERVAL)
+            self.wakeup.clear()
+            # the connection of the previous check may have timed out
+            close_old_connections()
+            try:
+                self._check()
+            except Exception as e:
+                self.logger.error('could not check the song cache')
+                self.logger.exception(e)
+
+    def _cache_dir(self):
+        return os.path.abspath(os.path.expanduser(settings.SONGS_CACHE_DIR))
+
+    def _scan(self):
+        ''' returns the path, size and time of caching of every song in the cache '''
+        files = []
+        try:
+            entries = list(os.scandir(self._cache_dir()))
+        except FileNotFoundError:
+            return files
+        for entry in entries:
+            if not entry.name.endswith('.m4a'):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            # youtube-dl sets the modification time to the upload date, the change time is when the file was written
+            files.append((entry.path, stat.st_size, stat.st_ctime))
+        return files
+
+    def _set_usage(self, used, files):
+        with self.lock:
+            changed = self.used // (1024 * 1024) != used // (1024 * 1024) or self.files != files
+            self.used = used
+            self.files = files
+        if changed:
+            self.settings_page.update_state()
+
+    def _check(self):
+        files = self._scan()
+        used = sum(size for _, size, _ in files)
+        self._set_usage(used, len(files))
+
+        budget = self.settings_page.song_cache_size * 1024 * 1024
+        if budget == 0 or used <= budget * settings.SONG_CACHE_HIGH_WATERMARK:
+            return
+        target = budget * settings.SONG_CACHE_LOW_WATERMARK
+        self.logger.info('song cache uses ' + str(used // (1024 * 1024)) + ' of ' + str(self.settings_page.song_cache_size) + ' MB, evicting songs')
+
+        count = len(files)
+        candidates = self._candidates(files)
+        while used > target and candidates:
+            # evict a few songs at a time, so the disk and the database are not blocked for long
+            batch = candidates[:settings.SONG_CACHE_EVICTION_BATCH]
+            candidates = candidates[settings.SONG_CACHE_EVICTION_BATCH:]
+            # the queue may have changed since the last batch
+            protected = self._protected()
+            evicted = 0
+            for path, size in batch:
+                if used <= target:
+                    break
+                if path in protected:
+                    continue
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                except OSError as e:
+                    self.logger.error('could not evict ' + path)
+                    self.logger.exception(e)
+                    continue
+                used -= size
+                count -= 1
+                evicted += 1
+            with self.lock:
+                self.evicted += evicted
+            self._set_usage(used, count)
+            if candidates:
+                time.sleep(settings.SONG_CACHE_EVICTION_PAUSE)
+
+        if used > target:
+            self.logger.warning('song cache could not be reduced below ' + str(int(target) // (1024 * 1024)) + ' MB, the remaining songs are queued')
+
+    def _protected(self):
+        ''' the paths of all songs that must not be evicted '''
+        urls = [song.internal_url for song in mirror.all()]
+        current_song = CurrentSong.objects.first()
+        if current_song is not None:
+            urls.append(current_song.internal_url)
+        return {os.path.abspath(url[len('file://'):]) for url in urls if url.startswith('file://')}
+
+    def _candidates(self, files):
+        ''' returns (path, size) of the songs that may be evicted, in the order they should be evicted.
+        Songs are scored by their number of requests divided by the days since they were last played,
+        so songs that were rarely requested and not played for a long time are evicted first. '''
+        # the archive entries of all cached songs, by their id
+        archived = {}
+        for url, counter, last_played in ArchivedSong.objects \
+                .filter(url__startswith='https://www.youtube.com/') \
+                .annotate(last_played=Max('playlog__created')) \
+                .values_list('url', 'counter', 'last_played'):
+            try:
+                archived[song_utils.id_from_url(url)] = (counter, last_played)
+            except KeyError:
+                continue
+
+        now = timezone.now().timestamp()
+        protected = self._protected()
+        scored = []
+        for path, size, cached in files:
+            if path in protected:
+                continue
+            song_id = os.path.splitext(os.path.basename(path))[0]
+            if now - cached < settings.SONG_CACHE_GRACE_PERIOD:
+                # the song was just downloaded and is probably about to be queued
+                continue
+            if song_id not in archived:
+                # files that were never requested through raveberry go first
+                score = -1
+            else:
+                counter, last_played = archived[song_id]
+                last_used = cached if last_played is None else max(cached, last_played.timestamp())
+                days = (now - last_used) / (24 * 60 * 60)
+                score = counter / (1 + days)
+            scored.append((score, cached, path, size))
+        scored.sort()
+        return [(path, size) for _, _, path, size in scored]
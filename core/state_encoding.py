@@ -0,0 +1,54 @@
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+
+import msgpack
+
+# websocket subprotocol with which clients request the compact encoding
+SUBPROTOCOL = 'raveberry.msgpack'
+
+# keys that the compact encoding transmits as their index in this list.
+# The client receives this list with the page, so it can be changed freely.
+KEY_DICTIONARY = [
+    # messages
+    'topic', 'version', 'state', 'patch',
+    # base
+    'partymode', 'users', 'visitors', 'lights_enabled', 'alarm', 'default_platform',
+    # musiq
+    'current_song', 'paused', 'progress', 'shuffle', 'repeat', 'autoplay', 'volume',
+    'song_queue', 'total_songs', 'total_duration',
+    'queue_previous_revision', 'queue_revision', 'queue_changed_from',
+    # songs
+    'id', 'queue_key', 'index', 'manually_requested', 'votes', 'external_url',
+    'artist', 'title', 'duration', 'duration_formatted', 'confirmed', 'replaces',
+]
+
+# fields that are only used by the server and not transmitted by the compact encoding
+SERVER_ONLY_FIELDS = {'internal_url'}
+
+_codes = {key: code for code, key in enumerate(KEY_DICTIONARY)}
+
+def enabled():
+    return settings.STATE_COMPACT_ENCODING
+
+def _compact(value):
+    if isinstance(value, dict):
+        return {_codes.get(key, key): _compact(entry) for key, entry in value.items() if key not in SERVER_ONLY_FIELDS}
+    if isinstance(value, list):
+        return [_compact(entry) for entry in value]
+    return value
+
+def _default(value):
+    # values that msgpack does not know are transmitted like in the json encoding, e.g. datetimes as strings
+    return DjangoJSONEncoder().default(value)
+
+def encode(message):
+    ''' encodes a state message with MessagePack, replacing known keys by their index in the dictionary '''
+    compact = {}
+    for key, value in message.items():
+        if key == 'patch':
+            # the second element of every operation is the key of the state it changes
+            value = [[op[0], _codes.get(op[1], op[1])] + _compact(op[2:]) for op in value]
+        else:
+            value = _compact(value)
+        compact[_codes[key]] = value
+    return msgpack.packb(compact, use_bin_type=True, default=_default)
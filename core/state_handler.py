@@ -1,35 +1,332 @@
-from channels.generic.websocket import WebsocketConsumer
+from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.layers import get_channel_layer
-from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponse
+from django.http import HttpResponseNotModified
 
+import core.state_encoding as state_encoding
+
+from collections import Counter
+import asyncio
+import copy
 import json
 import time
+import logging
 
 from threading import Thread
+from threading import Lock
+from threading import Event
+
+# lists in a state that are diffed entry by entry instead of being resent as a whole
+LIST_KEYS = {'song_queue'}
+
+# the base topic contains website wide state, every client receives it in addition to its page's topic.
+# the fields of the base state are published on their own topic, so the other producers do not include them
+TOPICS = ['base', 'musiq', 'lights', 'pad', 'settings']
+
+def group_name(topic):
+    return 'state_' + topic
+
+class Topic:
+    # every state producer (base, musiq, lights, ...) publishes a versioned stream of its state.
+    # Clients that know the previous version apply the patch, all others fetch a full snapshot.
+    def __init__(self, name):
+        self.name = name
+        self.version = 0
+        self.state = None
+        # when the state was last verified to be current
+        self.published = 0
+        # the serialized state, computed at most once per version and shared by all clients
+        self.state_text = None
+        self.compact_message = None
+        self.lock = Lock()
+        # only one thread recomputes an outdated snapshot, the others wait for its result
+        self.compute_lock = Lock()
+
+    def etag(self):
+        return '"' + self.name + '-' + str(self.version) + '"'
+
+    def snapshot(self):
+        ''' returns the current version and its serialized state. Needs to be called with lock held. '''
+        if self.state_text is None:
+            self.state_text = json.dumps(self.state, cls=DjangoJSONEncoder)
+        return self.version, self.state_text
+
+    def snapshot_message(self):
+        ''' returns the serialized message that transmits the full state to a client, or None if there is no state yet '''
+        with self.lock:
+            if self.state is None:
+                return None
+            version, state_text = self.snapshot()
+        # compose the message from the already serialized state
+        return '{"topic": ' + json.dumps(self.name) + ', "version": ' + str(version) + ', "state": ' + state_text + '}'
+
+    def compact_snapshot_message(self):
+        ''' returns the snapshot message in the compact encoding, or None if there is no state yet '''
+        with self.lock:
+            if self.state is None:
+                return None
+            if self.compact_message is None:
+                self.compact_message = state_encoding.encode({'topic': self.name, 'version': self.version, 'state': self.state})
+            return self.compact_message
+
+_topics = {}
+_topics_lock = Lock()
+
+def _get_topic(name):
+    with _topics_lock:
+        if name not in _topics:
+            _topics[name] = Topic(name)
+        return _topics[name]
+
+def _entry_key(entry):
+    # placeholders are not in the database yet and thus have no id
+    if 'id' in entry:
+        return entry['id']
+    return 'placeholder:' + entry['title']
+
+def _diff_list(key, old, new):
+    ops = []
+    new_keys = [_entry_key(entry) for entry in new]
+
+    # remove entries that are not present anymore, back to front so the indices stay valid
+    remaining = Counter(new_keys)
+    kept = []
+    for entry in old:
+        entry_key = _entry_key(entry)
+        kept.append(remaining[entry_key] > 0)
+        if kept[-1]:
+            remaining[entry_key] -= 1
+    for index in reversed(range(len(old))):
+        if not kept[index]:
+            ops.append(['remove', key, index])
+    working = [entry for entry, keep in zip(old, kept) if keep]
+
+    # walk the new list and move, insert or update entries until the working copy matches it
+    for index, entry in enumerate(new):
+        for position in range(index, len(working)):
+            if _entry_key(working[position]) == new_keys[index]:
+                break
+        else:
+            ops.append(['insert', key, index, entry])
+            working.insert(index, entry)
+            continue
+        if position != index:
+            ops.append(['move', key, position, index])
+            working.insert(index, working.pop(position))
+        old_entry = working[index]
+        if old_entry.keys() != entry.keys():
+            ops.append(['remove', key, index])
+            ops.append(['insert', key, index, entry])
+        else:
+            changes = {field: value for field, value in entry.items() if old_entry[field] != value}
+            if changes:
+                ops.append(['update', key, index, changes])
+        working[index] = entry
+    return ops
+
+def diff(old, new):
+    ''' computes a list of operations that transforms the state old into the state new '''
+    ops = []
+    for key, value in new.items():
+        if key in old and old[key] == value:
+            continue
+        if key in LIST_KEYS and isinstance(old.get(key), list) and isinstance(value, list):
+            ops += _diff_list(key, old[key], value)
+        else:
+            ops.append(['set', key, value])
+    for key in old:
+        if key not in new:
+            ops.append(['delete', key])
+    return ops
+
+def update_state(topic, state):
+    ''' publishes the given state on its topic. Returns the version of the published state. '''
+    # the producers may reuse objects in their state, keep an unshared copy to diff against
+    state = copy.deepcopy(state)
+    topic = _get_topic(topic)
+    with topic.lock:
+        topic.published = time.time()
+        if topic.state is None:
+            message = {'topic': topic.name, 'version': topic.version + 1, 'state': state}
+        else:
+            patch = diff(topic.state, state)
+            if not patch:
+                return topic.version
+            message = {'topic': topic.name, 'version': topic.version + 1, 'patch': patch}
+
+        # serialize once, every consumer forwards the same text
+        # the version is only taken once serializing succeeded, otherwise clients would miss it
+        data = {
+            'type': 'state_update',
+            'text': json.dumps(message, cls=DjangoJSONEncoder),
+        }
+        if state_encoding.enabled():
+            data['binary'] = state_encoding.encode(message)
+
+        topic.version += 1
+        topic.state = state
+        topic.state_text = None
+        topic.compact_message = None
+        # queue while holding the lock so versions arrive in order
+        sender.send(group_name(topic.name), data)
+        return topic.version
+
+class Sender:
+    ''' Forwards messages to the channel layer from its own event loop, so publishing never blocks the calling thread '''
+    def __init__(self):
+        self.logger = logging.getLogger('raveberry')
+        self.loop = None
+        self.queue = None
+        self.started = Event()
+
+    def start(self):
+        Thread(target=self._run, daemon=True).start()
+        self.started.wait()
+
+    def send(self, group, message):
+        ''' queues a message for the given group. Messages are sent in the order they were queued. '''
+        self.loop.call_soon_threadsafe(self.queue.put_nowait, (group, message))
+
+    def _run(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.queue = asyncio.Queue()
+        self.started.set()
+        self.loop.run_until_complete(self._forward())
+
+    async def _forward(self):
+        channel_layer = get_channel_layer()
+        while True:
+            group, message = await self.queue.get()
+            try:
+                await channel_layer.group_send(group, message)
+            except Exception as e:
+                self.logger.error('could not send state to ' + group)
+                self.logger.exception(e)
+
+sender = Sender()
+
+class Publisher:
+    ''' Collects topics whose state changed and publishes each of them once per coalescing window '''
+    def __init__(self):
+        self.logger = logging.getLogger('raveberry')
+        self.state_functions = {}
+        self.dirty = set()
+        self.dirty_lock = Lock()
+        self.changed = Event()
+
+    def register(self, topic, state_function):
+        self.state_functions[topic] = state_function
+
+    def mark_dirty(self, topic):
+        with self.dirty_lock:
+            self.dirty.add(topic)
+        self.changed.set()
+
+    def start(self):
+        Thread(target=self._loop, daemon=True).start()
+
+    def _loop(self):
+        while True:
+            self.changed.wait()
+            # wait for further changes caused by the same action
+            time.sleep(settings.STATE_COALESCE_WINDOW)
+            with self.dirty_lock:
+                self.changed.clear()
+                dirty = self.dirty
+                self.dirty = set()
+            for topic in dirty:
+                try:
+                    update_state(topic, self.state_functions[topic]())
+                except Exception as e:
+                    self.logger.error('could not publish state of ' + topic)
+                    self.logger.exception(e)
+
+publisher = Publisher()
+
+def register(topic, state_function):
+    publisher.register(topic, state_function)
+
+def mark_dirty(topic):
+    ''' schedules the state of the given topic to be computed and published '''
+    publisher.mark_dirty(topic)
+
+def start_publisher():
+    sender.start()
+    publisher.start()
+
+def state_response(request, topic):
+    ''' returns the latest published state of the given topic. The publisher refreshes it in the background if it is outdated. '''
+    topic = _get_topic(topic)
+    with topic.compute_lock:
+        if topic.state is None:
+            # nothing was published yet. publishing makes sure the returned state is exactly the one the next patch is based on
+            update_state(topic.name, publisher.state_functions[topic.name]())
+        elif time.time() - topic.published > settings.STATE_SNAPSHOT_MAX_AGE:
+            # a page load must not broadcast on its own, the publisher coalesces this with other changes
+            mark_dirty(topic.name)
+    with topic.lock:
+        etag = topic.etag()
+        if request.META.get('HTTP_IF_NONE_MATCH') == etag:
+            response = HttpResponseNotModified()
+        else:
+            version, state_text = topic.snapshot()
+            response = HttpResponse(state_text, content_type='application/json')
+            response['X-State-Version'] = version
+    response['ETag'] = etag
+    # let browsers revalidate their cached state on every request
+    response['Cache-Control'] = 'no-cache'
+    return response
+
+class StateConsumer(AsyncWebsocketConsumer):
+    # the consumer runs on daphne's event loop, so connected clients do not occupy its thread pool
+    async def connect(self):
+        topic = self.scope['url_route']['kwargs'].get('topic')
+        if topic is None:
+            # clients that do not specify a topic receive every state
+            self.topics = TOPICS
+        elif topic in TOPICS:
+            self.topics = ['base', topic]
+        else:
+            await self.close()
+            return
+        for topic in self.topics:
+            await self.channel_layer.group_add(group_name(topic), self.channel_name)
+        # clients can request the compact encoding
+        self.compact = state_encoding.enabled() and state_encoding.SUBPROTOCOL in self.scope['subprotocols']
+        if self.compact:
+            await self.accept(state_encoding.SUBPROTOCOL)
+        else:
+            await self.accept()
+        # send the current snapshots so the client does not need to request them.
+        # They are serialized at most once per version, so this rarely blocks the loop.
+        for name in self.topics:
+            with _topics_lock:
+                topic = _topics.get(name)
+            if topic is None:
+                continue
+            if self.compact:
+                message = topic.compact_snapshot_message()
+                if message is not None:
+                    await self.send(bytes_data=message)
+            else:
+                message = topic.snapshot_message()
+                if message is not None:
+                    await self.send(text_data=message)
+
+    async def disconnect(self, close_code):
+        for topic in getattr(self, 'topics', []):
+            await self.channel_layer.group_discard(group_name(topic), self.channel_name)
 
-def update_state(state):
-    data = {
-        'type': 'state_update',
-        'state': state,
-    }
-    channel_layer = get_channel_layer()
-    async_to_sync(channel_layer.group_send)(
-        'state',
-        data
-    )
-
-class StateConsumer(WebsocketConsumer):
-    def connect(self):
-        async_to_sync(self.channel_layer.group_add)('state', self.channel_name)
-        self.accept()
-
-    def disconnect(self, close_code):
-        async_to_sync(self.channel_layer.group_discard)('state', self.channel_name)
-
-    def receive(self, text_data):
+    async def receive(self, text_data=None, bytes_data=None):
         pass
 
     # Receive message from room group
-    def state_update(self, event):
+    async def state_update(self, event):
         # Send message to WebSocket
-        self.send(text_data=json.dumps(event['state']))
+        if self.compact:
+            await self.send(bytes_data=event['binary'])
+        else:
+            await self.send(text_data=event['text'])
@@ -0,0 +1,89 @@
+from django.conf import settings
+
+import subprocess
+import threading
+import logging
+import os
+
+class SystemStatus:
+    ''' Probes the state of the system services in the background and serves the cached results '''
+    PROBES = {
+        'homewifi_enabled': ['/usr/local/sbin/raveberry/homewifi_enabled'],
+        'events_enabled': ['/usr/local/sbin/raveberry/events_enabled'],
+        'hotspot_enabled': ['/usr/local/sbin/raveberry/hotspot_enabled'],
+        'wifi_protected': ['/usr/local/sbin/raveberry/wifi_protected'],
+        'tunneling_enabled': ['sudo', '/usr/local/sbin/raveberry/tunneling_enabled'],
+        'remote_enabled': ['/usr/local/sbin/raveberry/remote_enabled'],
+    }
+
+    def __init__(self, settings_page):
+        self.settings_page = settings_page
+        self.logger = logging.getLogger('raveberry')
+
+        self.status = {}
+        self.homewifi_ssid = ''
+        self.lock = threading.Lock()
+
+        # probe everything once on startup
+        self.invalidated = set(SystemStatus.PROBES)
+        self.homewifi_invalidated = True
+        self.wakeup = threading.Event()
+        self.wakeup.set()
+
+    def start(self):
+        threading.Thread(target=self._loop, daemon=True).start()
+
+    def invalidate(self, key):
+        ''' schedules the given probe to be run again, e.g. after the corresponding service was changed '''
+        with self.lock:
+            if key == 'homewifi_ssid':
+                self.homewifi_invalidated = True
+            else:
+                self.invalidated.add(key)
+        self.wakeup.set()
+
+    def state_dict(self):
+        with self.lock:
+            state_dict = dict(self.status)
+            state_dict['homewifi_ssid'] = self.homewifi_ssid
+        return state_dict
+
+    def _loop(self):
+        while True:
+            if not self.wakeup.wait(timeout=settings.SYSTEM_STATUS_REFRESH_INTERVAL):
+                # no probe was invalidated during the interval, refresh all of them
+                self.invalidate('homewifi_ssid')
+                for key in SystemStatus.PROBES:
+                    self.invalidate(key)
+            with self.lock:
+                self.wakeup.clear()
+                invalidated = self.invalidated
+                self.invalidated = set()
+                homewifi_invalidated = self.homewifi_invalidated
+                self.homewifi_invalidated = False
+
+            changed = False
+            if homewifi_invalidated:
+                homewifi_ssid = self._read_homewifi_ssid()
+                with self.lock:
+                    changed |= homewifi_ssid != self.homewifi_ssid
+                    self.homewifi_ssid = homewifi_ssid
+            for key in invalidated:
+                try:
+                    value = subprocess.call(SystemStatus.PROBES[key]) != 0
+                except FileNotFoundError:
+                    self.logger.error('scripts not installed')
+                    continue
+                with self.lock:
+                    changed |= self.status.get(key) != value
+                    self.status[key] = value
+
+            if changed:
+                self.settings_page.update_state()
+
+    def _read_homewifi_ssid(self):
+        try:
+            with open(os.path.join(settings.BASE_DIR, 'config/homewifi')) as f:
+                return f.read()
+        except FileNotFoundError:
+            return ''
@@ -0,0 +1,113 @@
+from channels.exceptions import ChannelFull
+
+from core.channel_layer import InProcessChannelLayer
+
+from threading import Event
+from threading import Thread
+from unittest import TestCase
+import asyncio
+import time
+
+def run(coroutine):
+    # every call uses a new event loop, like the threads that share the layer
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+class InProcessChannelLayerTest(TestCase):
+
+    def test_send_receive(self):
+        layer = InProcessChannelLayer()
+        run(layer.send('test.channel', {'type': 'test.message', 'text': 'hello'}))
+        message = run(layer.receive('test.channel'))
+        self.assertEqual(message, {'type': 'test.message', 'text': 'hello'})
+        # received channels without messages are forgotten
+        self.assertNotIn('test.channel', layer.channels)
+
+    def test_receive_from_other_thread(self):
+        layer = InProcessChannelLayer()
+        received = []
+        waiting = Event()
+
+        async def receive():
+            receiving = asyncio.ensure_future(layer.receive('test.channel'))
+            # let the receiver register its waiter before the message is sent
+            await asyncio.sleep(0.05)
+            waiting.set()
+            received.append(await asyncio.wait_for(receiving, timeout=2))
+
+        receiver = Thread(target=run, args=(receive(),))
+        receiver.start()
+        self.assertTrue(waiting.wait(timeout=2))
+        run(layer.send('test.channel', {'type': 'test.message'}))
+        receiver.join(timeout=3)
+        self.assertFalse(receiver.is_alive())
+        self.assertEqual(received, [{'type': 'test.message'}])
+
+    def test_group_send(self):
+        layer = InProcessChannelLayer()
+        run(layer.group_add('test-group', 'test.first'))
+        run(layer.group_add('test-group', 'test.second'))
+        run(layer.group_send('test-group', {'type': 'test.message'}))
+        self.assertEqual(run(layer.receive('test.first')), {'type': 'test.message'})
+        self.assertEqual(run(layer.receive('test.second')), {'type': 'test.message'})
+
+        run(layer.group_discard('test-group', 'test.first'))
+        run(layer.group_send('test-group', {'type': 'test.other'}))
+        self.assertNotIn('test.first', layer.channels)
+        self.assertEqual(run(layer.receive('test.second')), {'type': 'test.other'})
+
+    def test_expiry(self):
+        layer = InProcessChannelLayer(expiry=0.05)
+        run(layer.send('test.channel', {'type': 'test.message'}))
+        time.sleep(0.1)
+        with self.assertRaises(asyncio.TimeoutError):
+            run(asyncio.wait_for(layer.receive('test.channel'), timeout=0.1))
+
+    def test_expiry_leaves_groups(self):
+        layer = InProcessChannelLayer(expiry=0.05)
+        run(layer.group_add('test-group', 'test.channel'))
+        run(layer.group_send('test-group', {'type': 'test.message'}))
+        time.sleep(0.1)
+        # the expired message shows that the channel is not read anymore
+        run(layer.send('test.channel', {'type': 'test.other'}))
+        self.assertNotIn('test.channel', layer.groups['test-group'])
+
+    def test_capacity(self):
+        layer = InProcessChannelLayer(capacity=2)
+        run(layer.send('test.channel', {'type': 'test.message'}))
+        run(layer.send('test.channel', {'type': 'test.message'}))
+        with self.assertRaises(ChannelFull):
+            run(layer.send('test.channel', {'type': 'test.message'}))
+        # full members of a group do not keep the others from receiving
+        run(layer.group_add('test-group', 'test.channel'))
+        run(layer.group_add('test-group', 'test.other'))
+        run(layer.group_send('test-group', {'type': 'test.group'}))
+        self.assertEqual(run(layer.receive('test.other')), {'type': 'test.group'})
+
+    def test_group_expiry(self):
+        layer = InProcessChannelLayer(group_expiry=0.05)
+        run(layer.group_add('test-group', 'test.channel'))
+        time.sleep(0.1)
+        run(layer.group_send('test-group', {'type': 'test.message'}))
+        self.assertNotIn('test.channel', layer.groups['test-group'])
+        self.assertNotIn('test.channel', layer.channels)
+
+    def test_cancelled_receive(self):
+        layer = InProcessChannelLayer()
+
+        async def cancel():
+            receiving = asyncio.ensure_future(layer.receive('test.channel'))
+            await asyncio.sleep(0.05)
+            self.assertIn('test.channel', layer.channels)
+            receiving.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await receiving
+
+        run(cancel())
+        self.assertNotIn('test.channel', layer.channels)
+        # the channel can be used again
+        run(layer.send('test.channel', {'type': 'test.message'}))
+        self.assertEqual(run(layer.receive('test.channel')), {'type': 'test.message'})
@@ -0,0 +1,44 @@
+from core.musiq.mopidy_actor import MopidyActor
+from core.musiq.mopidy_actor import READ
+
+from concurrent.futures import TimeoutError
+from threading import Event
+from unittest import TestCase
+
+class MopidyActorTest(TestCase):
+
+    def _block(self, actor):
+        # occupies the actor until the returned event is set
+        release = Event()
+        started = Event()
+        def blocking():
+            started.set()
+            release.wait(timeout=5)
+        actor.submit(blocking)
+        self.assertTrue(started.wait(timeout=2))
+        return release
+
+    def test_run(self):
+        actor = MopidyActor()
+        self.assertEqual(actor.run(lambda: 42, timeout=2), 42)
+
+    def test_replace_pending(self):
+        actor = MopidyActor()
+        release = self._block(actor)
+        first = actor.submit(lambda: 'first', key='volume')
+        second = actor.submit(lambda: 'second', key='volume')
+        release.set()
+        self.assertIs(first, second)
+        self.assertEqual(first.result(timeout=2), 'second')
+
+    def test_resubmit_after_timeout(self):
+        actor = MopidyActor()
+        release = self._block(actor)
+        with self.assertRaises(TimeoutError):
+            actor.run(lambda: 'timed out', priority=READ, key='sync', timeout=0.05)
+        # the next command with the same key is executed instead of receiving the cancelled one
+        future = actor.submit(lambda: 'synced', priority=READ, key='sync')
+        self.assertFalse(future.cancelled())
+        release.set()
+        self.assertEqual(future.result(timeout=2), 'synced')
+        self.assertEqual(actor.run(lambda: 'again', priority=READ, key='sync', timeout=2), 'again')
@@ -31,6 +31,7 @@ else:
             path('submit_hashtag/', base.submit_hashtag, name='submit_hashtag'),
             path('musiq/', include([
                 path('state/', base.musiq.get_state, name='musiq_state'),
+                path('queue_range/', base.musiq.get_queue_range, name='queue_range'),
                 path('random_suggestion/', base.musiq.suggestions.random_suggestion, name='random_suggestion'),
                 path('request_music/', base.musiq.request_music, name='request_music'),
                 path('suggestions/', base.musiq.suggestions.get_suggestions, name='suggestions'),
@@ -80,6 +81,7 @@ else:
                 path('set_downvotes_to_kick/', base.settings.set_downvotes_to_kick, name='set_downvotes_to_kick'),
                 path('set_max_download_size/', base.settings.set_max_download_size, name='set_max_download_size'),
                 path('set_max_playlist_items/', base.settings.set_max_playlist_items, name='set_max_playlist_items'),
+                path('set_song_cache_size/', base.settings.set_song_cache_size, name='set_song_cache_size'),
                 path('check_internet/', base.settings.check_internet, name='check_internet'),
                 path('update_user_count/', base.settings.update_user_count, name='update_user_count'),
 
@@ -117,6 +119,7 @@ else:
         path('api/', include([
             path('musiq/', include([
                 path('post_song/', base.musiq.post_song, name='post_song'),
+                path('post_songs/', base.musiq.post_songs, name='post_songs'),
             ])),
         ])),
     ]
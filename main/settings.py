@@ -158,13 +158,56 @@ STATICFILES_FINDERS = (
 # channels
 ASGI_APPLICATION = "main.routing.application"
 CHANNEL_LAYERS = {
-    'default': {
+    'redis': {
         'BACKEND': 'channels_redis.core.RedisChannelLayer',
         'CONFIG': {
             "hosts": [('127.0.0.1', 6379)],
         },
     },
+    # daphne and the state publisher share one process, so redis is not needed to connect them
+    'inprocess': {
+        'BACKEND': 'core.channel_layer.InProcessChannelLayer',
+    },
 }
+if os.environ.get('DJANGO_INPROCESS_CHANNEL_LAYER'):
+    CHANNEL_LAYERS['default'] = CHANNEL_LAYERS['inprocess']
+else:
+    CHANNEL_LAYERS['default'] = CHANNEL_LAYERS['redis']
+
+# seconds to wait for further changes before a changed state is published
+STATE_COALESCE_WINDOW = 0.1
+# seconds a state snapshot is served to http requests before the publisher is asked to recompute it
+STATE_SNAPSHOT_MAX_AGE = 1
+# seconds after which the status of system services is probed again
+SYSTEM_STATUS_REFRESH_INTERVAL = 60
+# number of songs at the head of the queue that are included in the musiq state
+QUEUE_WINDOW_SIZE = 50
+# allow clients to receive state updates encoded with MessagePack instead of json
+STATE_COMPACT_ENCODING = False
+# seconds between requests for mopidy's playback state, in case one of its events was missed
+PLAYBACK_POLL_INTERVAL = 5
+# seconds between checkpoints of the playback position, which is used to resume the song after a restart
+PLAYBACK_CHECKPOINT_INTERVAL = 30
+# add the next song to mopidy's tracklist while the current one is playing, so songs follow each other without a gap
+GAPLESS_LOOKAHEAD = False
+# seconds the player waits for a queued mopidy command before it gives up on it
+MOPIDY_COMMAND_TIMEOUT = 3
+# number of songs that are downloaded at the same time
+DOWNLOAD_WORKERS = 2
+# seconds for which the extracted information of a youtube video is reused
+YOUTUBE_INFO_TTL = 300
+# seconds for which a search is answered with the song it led to before, without searching again
+QUERY_RESOLUTION_MAX_AGE = 30 * 24 * 60 * 60
+# seconds between checks of the song cache, it is also checked after downloads and whenever a song left the queue
+SONG_CACHE_CHECK_INTERVAL = 600
+# fractions of the song cache size, songs are evicted once the cache exceeds the high watermark until it is below the low watermark
+SONG_CACHE_HIGH_WATERMARK = 0.95
+SONG_CACHE_LOW_WATERMARK = 0.85
+# number of songs that are evicted at once and the seconds to pause between these batches
+SONG_CACHE_EVICTION_BATCH = 10
+SONG_CACHE_EVICTION_PAUSE = 1
+# seconds after a download during which the song is not evicted, it is usually queued right after
+SONG_CACHE_GRACE_PERIOD = 600
 
 # Logging
 
@@ -130,12 +130,132 @@ function updateState(newState) {
 }
 
 function getState() {
-	$.get(urls['state'], function(state) {
-		updateState(state);
-	});
+	fetchTopicState('base');
+	if (stateTopic != 'base') {
+		fetchTopicState(stateTopic);
+	}
 }
+// milliseconds to wait for the snapshots the server sends on a new connection, before they are requested
+const SNAPSHOT_TIMEOUT = 2000;
 function reconnect() {
-	getState();
+	// updates could have been missed while disconnected.
+	// the server sends a snapshot of every topic on the new connection, only the ones that do not arrive are fetched
+	let topics = stateTopic == 'base' ? ['base'] : ['base', stateTopic];
+	awaitedSnapshots = {};
+	$.each(topics, function(_, topic) {
+		awaitedSnapshots[topic] = true;
+	});
+	setTimeout(function() {
+		$.each(awaitedSnapshots, function(topic) {
+			fetchTopicState(topic);
+		});
+		awaitedSnapshots = {};
+	}, SNAPSHOT_TIMEOUT);
+}
+
+// the latest known state and its version for every topic the server publishes
+let topicStates = {};
+let topicVersions = {};
+let fetchingTopics = {};
+// the topics whose snapshot is expected on the socket after a reconnect
+let awaitedSnapshots = {};
+// counts the snapshots received on the socket, fetched states that were requested before one of them are outdated
+let socketSnapshots = {};
+
+function applyPatch(state, patch) {
+	$.each(patch, function(_, op) {
+		let key = op[1];
+		if (op[0] == 'set') {
+			state[key] = op[2];
+		} else if (op[0] == 'delete') {
+			delete state[key];
+		} else if (op[0] == 'insert') {
+			state[key].splice(op[2], 0, op[3]);
+		} else if (op[0] == 'remove') {
+			state[key].splice(op[2], 1);
+		} else if (op[0] == 'move') {
+			let entry = state[key].splice(op[2], 1)[0];
+			state[key].splice(op[3], 0, entry);
+		} else if (op[0] == 'update') {
+			Object.assign(state[key][op[2]], op[3]);
+		}
+	});
+}
+
+function fetchTopicState(topic) {
+	if (fetchingTopics[topic]) {
+		return;
+	}
+	fetchingTopics[topic] = true;
+	let snapshots = socketSnapshots[topic];
+	$.get(stateUrls[topic], function(state, status, xhr) {
+		if (socketSnapshots[topic] !== snapshots) {
+			// the socket delivered a snapshot in the meantime, it is at least as recent
+			return;
+		}
+		topicStates[topic] = state;
+		topicVersions[topic] = parseInt(xhr.getResponseHeader('X-State-Version'));
+		refreshState();
+	}).always(function() {
+		fetchingTopics[topic] = false;
+	});
+}
+
+function handleStateMessage(message) {
+	let topic = message.topic;
+	if ('state' in message) {
+		topicStates[topic] = message.state;
+		socketSnapshots[topic] = (socketSnapshots[topic] || 0) + 1;
+		delete awaitedSnapshots[topic];
+	} else if (topic in topicVersions && message.version <= topicVersions[topic]) {
+		// already contained in a fetched snapshot
+		return;
+	} else if (topic in topicVersions && message.version == topicVersions[topic] + 1) {
+		applyPatch(topicStates[topic], message.patch);
+	} else {
+		// an update was missed, the patch can not be applied
+		fetchTopicState(topic);
+		return;
+	}
+	topicVersions[topic] = message.version;
+	refreshState();
+}
+
+function expandStateKeys(value) {
+	// numeric keys in the compact encoding are indices into the key dictionary
+	if (Array.isArray(value)) {
+		return value.map(expandStateKeys);
+	}
+	if (value !== null && typeof value === 'object') {
+		let expanded = {};
+		for (let key in value) {
+			let name = /^\d+$/.test(key) ? STATE_KEYS[parseInt(key)] : key;
+			expanded[name] = expandStateKeys(value[key]);
+		}
+		return expanded;
+	}
+	return value;
+}
+
+function decodeCompactMessage(data) {
+	let message = expandStateKeys(MessagePack.decode(new Uint8Array(data)));
+	if ('patch' in message) {
+		$.each(message.patch, function(_, op) {
+			if (typeof op[1] === 'number') {
+				op[1] = STATE_KEYS[op[1]];
+			}
+		});
+	}
+	return message;
+}
+
+function refreshState() {
+	// wait until the base state and the page's state are both known
+	if (!('base' in topicStates) || !(stateTopic in topicStates)) {
+		return;
+	}
+	// pages keep references to their previous state, hand them a copy
+	updateState(jQuery.extend(true, {}, topicStates['base'], topicStates[stateTopic]));
 }
 
 function decideScrolling(span, seconds_per_pixel, static_seconds) {
@@ -4,17 +4,23 @@ const options = {
     connectionTimeout: 1000,
 };
 
-let socketUrl = window.location.host + '/state/';
+let socketUrl = window.location.host + '/state/' + stateTopic + '/';
 if (window.location.protocol == 'https:') {
 	socketUrl = 'wss://' + socketUrl;
 } else {
 	socketUrl = 'ws://' + socketUrl;
 }
-let stateSocket = new ReconnectingWebSocket(socketUrl, [], options);
+// request the compact encoding if the server offers it
+let protocols = COMPACT_STATE ? ['raveberry.msgpack'] : [];
+let stateSocket = new ReconnectingWebSocket(socketUrl, protocols, options);
+stateSocket.binaryType = 'arraybuffer';
 
 stateSocket.addEventListener('message', (e) => {
-	let newState = JSON.parse(e.data);
-	updateState(newState);
+	if (typeof e.data === 'string') {
+		handleStateMessage(JSON.parse(e.data));
+	} else {
+		handleStateMessage(decodeCompactMessage(e.data));
+	}
 });
 
 let firstConnect = true;
@@ -1,5 +1,13 @@
 let state = null;
 let animationInProgress = false;
+// the state only contains the head of the queue, this many songs after it were loaded on request
+let loadedQueueSongs = 0;
+let loadingQueueSongs = false;
+const QUEUE_PAGE_SIZE = 50;
+// the songs that were loaded after the head, how many were requested and the queue revision they were loaded at
+let extraSongs = [];
+let extraSongsCount = 0;
+let extraSongsRevision = null;
 
 specificState = function (newState) {
 	updateBaseState(newState);
@@ -8,6 +16,14 @@ specificState = function (newState) {
 		// this state is not meant for a musiq update
 		return;
 	}
+	if (loadedQueueSongs > 0 && !newState.queue_extended) {
+		if (!extraSongsValid(newState)) {
+			extendQueue(newState);
+			return;
+		}
+		insertExtraSongs(newState, extraSongs);
+		extraSongsRevision = newState.queue_revision;
+	}
 	// create deep copy
 	let oldState = null;
 	if (state != null) {
@@ -163,11 +179,78 @@ specificState = function (newState) {
 		</li>
 		*/
 
+	let shownSongs = state.song_queue.filter((song) => song.confirmed).length;
+	if (state.total_songs > shownSongs) {
+		$('#queue_more_text').text((state.total_songs - shownSongs) + ' more songs (' + state.total_duration + ' in total)');
+		$('#queue_more').show();
+	} else {
+		$('#queue_more').hide();
+	}
+
 	// don't start a new animation when an old one is still in progress
 	// the running animation will end in the (then) current state
 	applyQueueChange(oldState, state);
 }
 
+function extraSongsValid(newState) {
+	// the loaded songs only need to be fetched again if a change since they were loaded affected their positions
+	if (extraSongsRevision === null || extraSongsCount != loadedQueueSongs) {
+		return false;
+	}
+	if (newState.queue_revision == extraSongsRevision) {
+		return true;
+	}
+	if (newState.queue_previous_revision != extraSongsRevision) {
+		// a state was missed, its changes are unknown
+		return false;
+	}
+	let loadedEnd = newState.song_queue.filter((song) => song.confirmed).length + loadedQueueSongs;
+	return newState.queue_changed_from !== null && newState.queue_changed_from >= loadedEnd;
+}
+
+function insertExtraSongs(newState, songs) {
+	// the loaded songs belong between the head of the queue and the placeholders
+	let confirmed = newState.song_queue.filter((song) => song.confirmed);
+	let placeholders = newState.song_queue.filter((song) => !song.confirmed);
+	newState.song_queue = confirmed.concat(jQuery.extend(true, [], songs), placeholders);
+}
+
+function extendQueue(newState) {
+	// fetch the songs after the head of the queue
+	loadingQueueSongs = true;
+	let start = newState.song_queue.filter((song) => song.confirmed).length;
+	let count = loadedQueueSongs;
+	$.get(urls['queue_range'], {start: start, count: count}, function(songs) {
+		extraSongs = songs;
+		extraSongsCount = count;
+		extraSongsRevision = newState.queue_revision;
+		insertExtraSongs(newState, songs);
+		newState.queue_extended = true;
+		specificState(newState);
+	}).always(function() {
+		loadingQueueSongs = false;
+	});
+}
+
+function loadMoreSongs() {
+	if (loadingQueueSongs) {
+		return;
+	}
+	loadedQueueSongs += QUEUE_PAGE_SIZE;
+	refreshState();
+}
+
+$(document).ready(function() {
+	$('#queue_more').on('click tap', loadMoreSongs);
+	$(window).on('scroll', function() {
+		// load further songs when the end of the queue is reached
+		if ($('#queue_more').is(':visible')
+			&& $(window).scrollTop() + $(window).height() >= $(document).height() - 100) {
+			loadMoreSongs();
+		}
+	});
+});
+
 function insertDisplayName(element, song) {
 	if (song.artist == null || song.artist == '') {
 		element.text(song.title);
@@ -11,6 +11,8 @@ specificState = function (newState) {
 	$('#alarm_probability').val(newState.alarm_probability);
 	$('#downvotes_to_kick').val(newState.downvotes_to_kick);
 	$('#max_download_size').val(newState.max_download_size);
+	$('#song_cache_size').val(newState.song_cache_size);
+	$('#song_cache_usage').text(newState.song_cache_used + ' MB in ' + newState.song_cache_files + ' songs, ' + newState.song_cache_evicted + ' evicted');
 	$('#max_playlist_items').val(newState.max_playlist_items);
 	$('#has_internet').prop("checked", newState.has_internet);
 
@@ -92,6 +94,11 @@ $(document).ready(function() {
 			value: $(this).val(),
 		});
 	});
+	$('#song_cache_size').change(function() {
+		$.post(urls['set_song_cache_size'], {
+			value: $(this).val(),
+		});
+	});
 	$('#check_internet').on('click tap', function() {
 		$.get(urls['check_internet']).done(function() {
 			successToast('');